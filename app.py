@@ -1,44 +1,96 @@
-import aiohttp_debugtoolbar
-import peewee_async
 from aiohttp import web
-from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
 from aiohttp_jwt import JWTMiddleware
+from task_manager.auth import AuthExecutor
+from task_manager.db import Manager
+from task_manager.events import USER_CHANNEL, TaskEvents
+from task_manager.identity import forget_user
+from task_manager.log_buffer import LogBuffer
+from task_manager.maintenance import Maintenance
+from task_manager.metrics import Metrics, metrics_middleware, pool_collector
 from task_manager.models import database
-from task_manager.settings import DATABASE, DEBUG, JWT_SECRET, logger
+from task_manager.profiler import (profile_hook, profiler_middleware,
+                                   slow_query_hook)
+from task_manager.settings import (APP_PROFILE, DATABASE, DB_POOL, DEBUG,
+                                   JWT_SECRET, MAINTENANCE_INTERVAL,
+                                   MAX_BODY_SIZE, PREPARED_STATEMENTS,
+                                   QUERY_PROFILER, TASK_LOG_BUFFER, logger)
+from task_manager.task_cache import create_task_cache
 from task_manager.urls import setup_routes
 
 jwt_middleware = JWTMiddleware(
     JWT_SECRET, request_property="user", credentials_required=False
 )
 
-async def create_app():
-    middlewares = [jwt_middleware]
-    
-    middlewares.append(aiohttp_debugtoolbar.middleware)
-    middlewares.append(validation_middleware)
-    app = web.Application(middlewares=middlewares)
-    
-    aiohttp_debugtoolbar.setup(
-        app, intercept_redirects=False, check_host=False)
-    setup_aiohttp_apispec(app, swagger_path="/docs")
+async def create_app(profile=APP_PROFILE):
+    """ В профиле development подключаем отладочную панель, валидацию apispec и Swagger.
+        В production только необходимые middleware, отладочные пакеты даже не импортируем.
+    """
+    middlewares = [metrics_middleware, jwt_middleware]
+    if QUERY_PROFILER:
+        middlewares.append(profiler_middleware)
+    development = profile == 'development'
+    if development:
+        import aiohttp_debugtoolbar
+        from aiohttp_apispec import setup_aiohttp_apispec, validation_middleware
+        middlewares.append(aiohttp_debugtoolbar.middleware)
+        middlewares.append(validation_middleware)
+
+    app = web.Application(middlewares=middlewares, client_max_size=MAX_BODY_SIZE)
+    if development:
+        aiohttp_debugtoolbar.setup(
+            app, intercept_redirects=False, check_host=False)
+        setup_aiohttp_apispec(app, swagger_path="/docs")
+
     setup_routes(app)
     app.logger = logger
+    app.metrics = Metrics()
     app.on_startup.append(on_start)
     app.on_cleanup.append(on_shutdown)
     return app
 
 
 async def on_start(app):
-    database.init(**DATABASE)
+    database.init(**DATABASE, **DB_POOL)
     app.database = database
     app.database.set_allow_sync(False)
-    app.objects = peewee_async.Manager(app.database)
+    app.objects = Manager(app.database, prepare=PREPARED_STATEMENTS)
+    app.objects.query_hooks.append(app.metrics.on_query)
+    app.objects.query_hooks.append(slow_query_hook)
+    if QUERY_PROFILER:
+        app.objects.query_hooks.append(profile_hook)
+    app.metrics.collectors.append(pool_collector(app.database))
+    # Открываем пул сразу, чтобы min_connections соединений были готовы к первым запросам.
+    await app.objects.connect()
+    app.auth = AuthExecutor()
+    app.task_cache = create_task_cache()
+    app.metrics.collectors.append(app.task_cache.collector())
+    app.task_events = TaskEvents()
+    app.metrics.collectors.append(app.task_events.collector())
+    # Удаленный пользователь или старый логин сразу перестают приниматься.
+    app.task_events.listen_to(USER_CHANNEL, forget_user)
+    app.log_buffer = None
+    if TASK_LOG_BUFFER:
+        app.log_buffer = LogBuffer(app.objects)
+        app.log_buffer.start()
+        app.metrics.collectors.append(app.log_buffer.collector())
+    app.maintenance = None
+    if MAINTENANCE_INTERVAL:
+        app.maintenance = Maintenance()
+        app.maintenance.start()
     if DEBUG:
         import aioreloader
         aioreloader.start()
 
 
 async def on_shutdown(app):
+    app.auth.shutdown()
+    if app.maintenance is not None:
+        await app.maintenance.close()
+    await app.task_events.close()
+    await app.task_cache.close()
+    # Дописываем отложенную историю, пока пул соединений еще открыт.
+    if app.log_buffer is not None:
+        await app.log_buffer.close()
     await app.objects.close()
     await app.shutdown()
 
@@ -0,0 +1,74 @@
+""" Сравнение сериализации списка задач: pydantic-модель на каждую строку
+    (как было в TaskAPI.get) и orjson напрямую из словарей .dicts().
+
+    python -m benchmarks.encode --rows 1000 --repeat 50
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from pydantic import BaseModel, constr
+
+from task_manager.encoders import dumps
+from task_manager.shemes import orjson_dumps
+
+
+class GetTaskSchema(BaseModel):
+    user: int
+    name: constr()
+    description: constr()
+    status: constr()
+    completion_at: datetime = None
+
+    class Config:
+        json_dumps = orjson_dumps
+
+
+def make_rows(count):
+    now = datetime.now()
+    return [{
+        'id': i,
+        'user': 1,
+        'name': f'Задача {i}',
+        'description': 'Описание задачи ' * 10,
+        'status': 'new',
+        'created_at': now + timedelta(seconds=i),
+        'completion_at': now + timedelta(days=i % 30),
+    } for i in range(count)]
+
+
+def pydantic_per_row(rows):
+    return json.dumps([GetTaskSchema(**row).json() for row in rows]).encode()
+
+
+def orjson_dicts(rows):
+    return dumps({'results': rows, 'next_cursor': None})
+
+
+def measure(func, rows, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(rows)
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'rows_per_second': len(rows) * repeat / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    result = {
+        'pydantic_per_row': measure(pydantic_per_row, rows, args.repeat),
+        'orjson_dicts': measure(orjson_dicts, rows, args.repeat),
+    }
+    result['speedup'] = (result['orjson_dicts']['rows_per_second']
+                         / result['pydantic_per_row']['rows_per_second'])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
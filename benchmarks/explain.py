@@ -0,0 +1,140 @@
+""" Проверка планов частых запросов: ни один не должен читать task или tasklog
+    последовательным сканированием. Запускать на большом наборе данных из
+    benchmarks.seed, на маленьких таблицах планировщик законно выбирает Seq Scan.
+
+    Запросы не пишутся здесь заново, а берутся из queries.py: шаблоны
+    (TASK_BY_ID, task_page, ...) подготавливаются на соединении, как это
+    делает Manager.prepared, и проверяется план EXPLAIN EXECUTE, остальные
+    строятся теми же функциями, что и во view.
+
+    python -m benchmarks.seed --users 50 --tasks 2000
+    python -m benchmarks.explain
+
+    Для запросов истории с нижней границей даты (from_date в /task/{id}/log)
+    дополнительно проверяем, что план читает только секции tasklog
+    с месяца этой даты.
+
+    Код возврата 1, если хотя бы один запрос упал в Seq Scan или не отбросил секции.
+"""
+import json
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from task_manager.models import Task, User, database
+from task_manager.partitions import partition_month
+from task_manager.queries import (TASK_BY_ID, TASKS_VERSION, USER_BY_LOGIN,
+                                  USER_BY_LOGIN_AND_ID, log_page, search_page,
+                                  task_page)
+from task_manager.settings import DATABASE, PAGE_SIZE
+
+from .seed import bench_users
+
+CHECKED_TABLES = ('task', 'tasklog')
+# Нижняя граница даты для запроса недавней истории.
+RECENT_FROM = (datetime.now() - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def hot_statements(user, task):
+    """ Шаблоны queries.py и параметры, с которыми их выполняют view. """
+    page = {
+        'user': user.id, 'status': 'new', 'completion_at': (datetime.now() - timedelta(days=30)).date(),
+        'q': task.name, 'after_created_at': task.created_at, 'after_id': task.id, 'limit': PAGE_SIZE + 1,
+    }
+    return {
+        'user_by_login': (USER_BY_LOGIN, {'login': user.login}),
+        'user_by_login_and_id': (USER_BY_LOGIN_AND_ID, {'login': user.login, 'id': user.id}),
+        'tasks_version': (TASKS_VERSION, {'user': user.id}),
+        'single_task': (TASK_BY_ID, {'id': task.id}),
+        'task_list': (task_page(None, False, False, False, False), page),
+        'task_list_after': (task_page(None, False, False, False, True), page),
+        'task_list_status': (task_page(None, True, False, False, False), page),
+        'task_list_completion_at': (task_page(None, False, True, False, False), page),
+        'task_list_q': (task_page(None, False, False, True, False), page),
+    }
+
+
+def hot_queries(user, task):
+    """ Запросы, которые view строят через peewee, теми же функциями queries.py. """
+    search = SimpleNamespace(q=task.name, status=None, completion_at=None, after=None, field_names=None)
+    return {
+        'task_search': search_page(user.id, search, PAGE_SIZE + 1),
+        'task_log': log_page(task.id, None, PAGE_SIZE + 1),
+        'task_log_since': log_page(task.id, (task.created_at, 0), PAGE_SIZE + 1),
+        'task_log_recent': log_page(task.id, None, PAGE_SIZE + 1, RECENT_FROM),
+    }
+
+
+# Запросы с нижней границей created_at: месяц, раньше которого секций в плане быть не должно.
+PRUNED_QUERIES = {'task_log_recent': RECENT_FROM.date().replace(day=1)}
+
+
+def checked(relation):
+    """ Таблица из CHECKED_TABLES или ее секция (tasklog_p2020_01, tasklog_default). """
+    return relation is not None and any(
+        relation == table or relation.startswith(f'{table}_p') or relation == f'{table}_default'
+        for table in CHECKED_TABLES)
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    return plan[0]['Plan']
+
+
+def explain_statement(cursor, statement, values):
+    """ План шаблона так, как его выполняет Manager.prepared: PREPARE и EXECUTE. """
+    bound = statement.bind(values)
+    cursor.execute(bound.prepare_sql())
+    try:
+        return explain(cursor, bound.execute_sql(), bound.params)
+    finally:
+        cursor.execute(f'DEALLOCATE {statement.name}')
+
+
+def check():
+    user = bench_users().order_by(User.id).first()
+    if user is None:
+        sys.exit('Нет тестовых данных, сначала запустите python -m benchmarks.seed')
+    task = Task.select().where(Task.user == user).order_by(Task.created_at).first()
+
+    cursor = database.cursor()
+    plans = {name: explain_statement(cursor, *case) for name, case in hot_statements(user, task).items()}
+    plans.update({name: explain(cursor, *query.sql()) for name, query in hot_queries(user, task).items()})
+
+    report = {}
+    for name, plan in plans.items():
+        nodes = list(plan_nodes(plan))
+        seq_scans = [
+            node['Relation Name'] for node in nodes
+            if node['Node Type'] == 'Seq Scan' and checked(node.get('Relation Name'))
+        ]
+        report[name] = {'ok': not seq_scans, 'seq_scans': seq_scans}
+        if name in PRUNED_QUERIES:
+            # Секции старше границы, которые планировщик не отбросил.
+            not_pruned = sorted({
+                node['Relation Name'] for node in nodes
+                if (partition_month(node.get('Relation Name') or '') or PRUNED_QUERIES[name]) < PRUNED_QUERIES[name]
+            })
+            report[name].update(ok=not seq_scans and not not_pruned, not_pruned=not_pruned)
+    return report
+
+
+def main():
+    database.init(**DATABASE)
+    with database.allow_sync():
+        report = check()
+    print(json.dumps(report, indent=2))
+    if not all(item['ok'] for item in report.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
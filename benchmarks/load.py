@@ -0,0 +1,223 @@
+""" Нагрузочный тест всех маршрутов API.
+
+    Нужны запущенное приложение и данные из benchmarks.seed:
+
+    python -m benchmarks.seed --users 20 --tasks 1000 --logs 5
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 50 --duration 10 --output before.json
+    ... изменения ...
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 50 --duration 10 --output after.json
+    python -m benchmarks.load --compare before.json after.json
+
+    Каждый сценарий гоняется duration секунд concurrency параллельными клиентами.
+    Результат - JSON: RPS, p50/p95/p99 задержки в мс и число ошибок по сценариям.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import aiohttp
+
+from .seed import LOGIN_PREFIX, PASSWORD
+
+SCENARIOS = (
+    'get_token', 'task_list', 'task_list_filtered', 'task_create',
+    'task_get', 'task_put', 'task_log', 'task_delete',
+)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class LoadTest:
+
+    def __init__(self, session, url, users):
+        self.session = session
+        self.url = url.rstrip('/')
+        self.users = users
+        self.tokens = {}
+        self.task_ids = {}
+        self.created = {}
+
+    async def prepare(self):
+        """ Получаем токены пользователей и по странице id задач каждого. """
+        for login in self.users:
+            async with self.session.post(f'{self.url}/get-token', data={'login': login, 'password': PASSWORD}) as resp:
+                resp.raise_for_status()
+                self.tokens[login] = (await resp.json())['access_token']
+            async with self.session.get(f'{self.url}/task', params={'limit': 100},
+                                        headers=self.headers(login)) as resp:
+                resp.raise_for_status()
+                self.task_ids[login] = [task['id'] for task in (await resp.json())['results']]
+            self.created[login] = []
+
+    def headers(self, login):
+        return {'Authorization': f'Bearer {self.tokens[login]}'}
+
+    def request(self, scenario):
+        """ Параметры запроса сценария для случайного пользователя. """
+        login = random.choice(self.users)
+        headers = self.headers(login)
+        task_id = random.choice(self.task_ids[login]) if self.task_ids[login] else 0
+        if scenario == 'get_token':
+            return 'POST', '/get-token', {'data': {'login': login, 'password': PASSWORD}}
+        if scenario == 'task_list':
+            return 'GET', '/task', {'headers': headers}
+        if scenario == 'task_list_filtered':
+            return 'GET', '/task', {'headers': headers, 'params': {'status': 'new', 'completion_at': '01-01-2020'}}
+        if scenario == 'task_create':
+            data = {'name': 'Нагрузочная задача', 'description': 'Описание', 'status': 'new'}
+            return 'POST', '/task', {'headers': headers, 'data': data, 'login': login}
+        if scenario == 'task_get':
+            return 'GET', f'/task/{task_id}', {'headers': headers}
+        if scenario == 'task_put':
+            data = {'status': random.choice(['new', 'planned', 'in_work'])}
+            return 'PUT', f'/task/{task_id}', {'headers': headers, 'data': data}
+        if scenario == 'task_log':
+            return 'GET', f'/task/{task_id}/log', {'headers': headers}
+        raise ValueError(scenario)
+
+    async def delete_request(self):
+        """ DELETE задачи, созданной сценарием task_create. Когда они кончились,
+            создаем новую (вне замера), чтобы не удалять несуществующие id.
+            None если создать задачу не удалось.
+        """
+        login = random.choice(self.users)
+        headers = self.headers(login)
+        if self.created[login]:
+            task_id = self.created[login].pop()
+        else:
+            data = {'name': 'Задача для удаления', 'description': 'Описание', 'status': 'new'}
+            try:
+                async with self.session.post(f'{self.url}/task', data=data, headers=headers) as resp:
+                    resp.raise_for_status()
+                    task_id = (await resp.json())['id']
+            except aiohttp.ClientError:
+                return None
+        return 'DELETE', f'/task/{task_id}', {'headers': headers}
+
+    async def worker(self, scenario, deadline, latencies, errors):
+        while time.perf_counter() < deadline:
+            if scenario == 'task_delete':
+                request = await self.delete_request()
+                if request is None:
+                    errors.append(1)
+                    continue
+                method, path, kwargs = request
+            else:
+                method, path, kwargs = self.request(scenario)
+            login = kwargs.pop('login', None)
+            start = time.perf_counter()
+            try:
+                async with self.session.request(method, self.url + path, **kwargs) as resp:
+                    body = await resp.read()
+                    ok = resp.status < 400
+            except aiohttp.ClientError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors.append(1)
+            elif login is not None:
+                self.created[login].append(json.loads(body)['id'])
+
+    async def run(self, scenario, concurrency, duration):
+        latencies = []
+        errors = []
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.worker(scenario, deadline, latencies, errors) for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    users = [f'{LOGIN_PREFIX}{n}' for n in range(args.users)]
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        test = LoadTest(session, args.url, users)
+        await test.prepare()
+        results = {}
+        for scenario in args.scenarios:
+            results[scenario] = await test.run(scenario, args.concurrency, args.duration)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'url': args.url,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+        },
+        'results': results,
+    }
+
+
+def compare(before_path, after_path):
+    """ Разница RPS и p99 между двумя прогонами. """
+    with open(before_path) as f:
+        before = json.load(f)['results']
+    with open(after_path) as f:
+        after = json.load(f)['results']
+    diff = {}
+    for scenario in after:
+        if scenario not in before:
+            continue
+        old, new = before[scenario], after[scenario]
+        diff[scenario] = {
+            'rps': [old['rps'], new['rps']],
+            'rps_change_pct': round((new['rps'] / old['rps'] - 1) * 100, 1) if old['rps'] else None,
+            'p99_ms': [old['p99_ms'], new['p99_ms']],
+        }
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест API')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10, help='секунд на сценарий')
+    parser.add_argument('--users', type=int, default=10, help='сколько сгенерированных пользователей использовать')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', help='куда записать результат в JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='сравнить два результата')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+
+    result = asyncio.get_event_loop().run_until_complete(run(args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
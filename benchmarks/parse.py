@@ -0,0 +1,72 @@
+""" Стоимость разбора и проверки тела запроса на создание задачи:
+    форма, как ее разбирает request.post(), с выбором полей по одному
+    (как было в TaskAPI.post), и JSON, разобранный orjson за один проход
+    сразу в TaskSchema.parse_obj (read_task). Для сравнения - тот же JSON
+    через стандартный json, как в request.json() по умолчанию.
+
+    python -m benchmarks.parse --repeat 20000
+"""
+import argparse
+import json
+import time
+from urllib.parse import parse_qsl, urlencode
+
+import orjson
+from multidict import MultiDict
+
+from task_manager.shemes import TaskSchema
+
+TASK = {
+    'name': 'Новая задача',
+    'description': 'Описание задачи ' * 20,
+    'status': 'new',
+    'completion_at': '02-10-2020',
+}
+
+
+def form_fields(body):
+    data = MultiDict(parse_qsl(body.decode(), keep_blank_values=True))
+    return TaskSchema(
+        user=1,
+        name=data.get('name'),
+        description=data.get('description'),
+        status=data.get('status'),
+        completion_at=data.get('completion_at'),
+    )
+
+
+def json_stdlib(body):
+    return TaskSchema.parse_obj({**json.loads(body), 'user': 1})
+
+
+def json_orjson(body):
+    return TaskSchema.parse_obj({**orjson.loads(body), 'user': 1})
+
+
+def measure(func, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(body)
+    elapsed = time.perf_counter() - start
+    return {'us_per_request': round(elapsed / repeat * 1e6, 2), 'body_bytes': len(body)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    form_body = urlencode(TASK).encode()
+    json_body = orjson.dumps(TASK)
+    result = {
+        'form_fields': measure(form_fields, form_body, args.repeat),
+        'json_stdlib': measure(json_stdlib, json_body, args.repeat),
+        'json_orjson': measure(json_orjson, json_body, args.repeat),
+    }
+    result['speedup'] = (result['form_fields']['us_per_request']
+                         / result['json_orjson']['us_per_request'])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
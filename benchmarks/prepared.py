@@ -0,0 +1,118 @@
+""" Что дают скомпилированные шаблоны и prepared statements (queries.py).
+
+    Для каждого горячего запроса меряем:
+    - python: построение запроса peewee и компиляцию в SQL на каждый вызов
+      (как было во view) против подстановки параметров в готовый шаблон;
+    - postgres: выполнение текста запроса с параметрами против EXECUTE
+      заранее подготовленного запроса на том же соединении, и время
+      планирования из EXPLAIN ANALYZE в обоих вариантах.
+
+    Данные берутся из benchmarks.seed, как и для benchmarks.explain.
+
+    python -m benchmarks.seed --users 50 --tasks 2000
+    python -m benchmarks.prepared --repeat 2000
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import peewee
+
+from task_manager.models import TASK_FIELDS, Task, User, database
+from task_manager.queries import (TASK_BY_ID, TASKS_VERSION,
+                                  USER_BY_LOGIN_AND_ID, task_page)
+from task_manager.settings import DATABASE, PAGE_SIZE
+
+from .seed import bench_users
+
+
+def cases(user, task):
+    """ Пары (запрос peewee как во view, шаблон, параметры шаблона). """
+    page = {'user': user.id, 'status': 'new', 'limit': PAGE_SIZE + 1,
+            'after_created_at': task.created_at, 'after_id': task.id}
+    return {
+        'user_by_login': (
+            lambda: User.select(User.id, User.login).where(User.login == user.login, User.id == user.id),
+            USER_BY_LOGIN_AND_ID, {'login': user.login, 'id': user.id}),
+        'tasks_version': (
+            lambda: User.select(User.tasks_version).where(User.id == user.id),
+            TASKS_VERSION, {'user': user.id}),
+        'single_task': (
+            lambda: Task.select(*TASK_FIELDS, Task.version).where(Task.id == task.id),
+            TASK_BY_ID, {'id': task.id}),
+        'task_list_status_after': (
+            lambda: Task.select(*TASK_FIELDS).where(Task.user == user, Task.status == 'new').where(
+                peewee.Tuple(Task.created_at, Task.id) > peewee.Tuple(task.created_at, task.id)
+            ).order_by(Task.created_at, Task.id).limit(PAGE_SIZE + 1),
+            task_page(None, True, False, False, True), page),
+    }
+
+
+def per_call_us(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def round_trip_ms(cursor, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def planning_ms(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    plan = plan if isinstance(plan, list) else json.loads(plan)
+    return plan[0]['Planning Time']
+
+
+def measure(cursor, build, statement, values, repeat):
+    bound = statement.bind(values)
+    sql, params = build().sql()
+    python = {
+        'peewee_build_and_compile_us': per_call_us(lambda: build().sql(), repeat),
+        'template_bind_us': per_call_us(lambda: statement.bind(values).execute_sql(), repeat),
+    }
+
+    cursor.execute(bound.prepare_sql())
+    try:
+        postgres = {
+            'plain_p50_ms': round_trip_ms(cursor, sql, params, repeat),
+            'prepared_p50_ms': round_trip_ms(cursor, bound.execute_sql(), bound.params, repeat),
+            # После repeat выполнений у prepared statement уже выбран план.
+            'plain_planning_ms': planning_ms(cursor, sql, params),
+            'prepared_planning_ms': planning_ms(cursor, bound.execute_sql(), bound.params),
+        }
+    finally:
+        cursor.execute(f'DEALLOCATE {statement.name}')
+
+    return {key: round(value, 3) for key, value in {**python, **postgres}.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Скомпилированные шаблоны и prepared statements')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    database.init(**DATABASE)
+    with database.allow_sync():
+        user = bench_users().order_by(User.id).first()
+        if user is None:
+            sys.exit('Нет тестовых данных, сначала запустите python -m benchmarks.seed')
+        task = Task.select().where(Task.user == user).order_by(Task.created_at).first()
+
+        cursor = database.cursor()
+        report = {name: measure(cursor, *case, args.repeat) for name, case in cases(user, task).items()}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+""" Задержка полнотекстового поиска в зависимости от числа задач пользователя.
+
+    Для каждого размера создаем пользователя с N задачами из синтетического
+    словаря и меряем запрос страницы поиска в том виде, в каком его строит
+    /task/search. Число совпадений по искомому слову держим постоянным,
+    поэтому при работе через индекс task_user_id_search время не должно
+    расти вместе с N. Пользователи создаются с префиксом benchmarks.seed
+    и удаляются через python -m benchmarks.seed --clear.
+
+    python -m benchmarks.search --sizes 1000 10000 100000 --repeat 50
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from task_manager.models import (TASK_FIELDS, Task, User, database,
+                                 search_match, search_rank)
+from task_manager.settings import DATABASE, PAGE_SIZE
+
+from .explain import explain, plan_nodes
+from .seed import BATCH_SIZE, LOGIN_PREFIX, chunked
+
+# Искомое слово встречается ровно в MATCHES задачах каждого пользователя.
+NEEDLE = 'бенчмарк'
+MATCHES = 200
+VOCABULARY = [f'слово{i}' for i in range(5000)]
+
+
+def create_user(size, rnd):
+    """ Пользователь с size задачами, NEEDLE в описании у MATCHES из них. """
+    login = f'{LOGIN_PREFIX}search_{size}'
+    User.delete().where(User.login == login).execute()
+    user = User.create(login=login, password='-')
+    now = datetime.now()
+    needles = set(rnd.sample(range(size), min(MATCHES, size)))
+    rows = []
+    for i in range(size):
+        words = rnd.choices(VOCABULARY, k=rnd.randint(5, 60))
+        if i in needles:
+            words.insert(rnd.randrange(len(words)), NEEDLE)
+        rows.append({
+            'user': user.id,
+            'name': ' '.join(rnd.choices(VOCABULARY, k=3)),
+            'description': ' '.join(words),
+            'status': 'new',
+            'created_at': now - timedelta(seconds=i),
+        })
+    for chunk in chunked(rows, BATCH_SIZE):
+        Task.insert_many(chunk).execute()
+    database.execute_sql('ANALYZE "task"')
+    return user
+
+
+def search_query(user, q):
+    """ Первая страница поиска, как в TaskSearchAPI. """
+    rank = search_rank(q)
+    return (Task.select(*TASK_FIELDS, rank.alias('rank'))
+            .where(Task.user == user.id, search_match(q))
+            .order_by(rank.desc(), Task.id.desc())
+            .limit(PAGE_SIZE + 1))
+
+
+def measure(user, repeat):
+    query = search_query(user, NEEDLE)
+    sql, params = query.sql()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        database.execute_sql(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    indexes = sorted({node['Index Name'] for node in plan_nodes(explain(query)) if 'Index Name' in node})
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'indexes': indexes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Задержка поиска от числа задач пользователя')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    database.init(**DATABASE)
+    report = {}
+    with database.allow_sync():
+        for size in args.sizes:
+            with database.atomic():
+                user = create_user(size, rnd)
+            report[size] = measure(user, args.repeat)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
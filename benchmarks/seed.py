@@ -0,0 +1,89 @@
+""" Генератор синтетических данных: пользователи с задачами и историей изменений.
+
+    python -m benchmarks.seed --users 50 --tasks 2000 --logs 3
+    python -m benchmarks.seed --clear
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from task_manager.auth import make_password
+from task_manager.models import STATUS_LIST, Task, TaskLog, User, database
+from task_manager.settings import DATABASE
+
+LOGIN_PREFIX = 'bench_user_'
+# Пароль всех сгенерированных пользователей, под ним входит нагрузочный тест.
+PASSWORD = 'bench-password'
+BATCH_SIZE = 5000
+
+
+def chunked(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def bench_users():
+    return User.select().where(User.login.startswith(LOGIN_PREFIX))
+
+
+def seed(users, tasks, logs, seed=0):
+    """ Создаем users пользователей, у каждого tasks задач и по logs записей истории на задачу.
+        Даты создания разбросаны на год назад, у части задач есть completion_at.
+    """
+    rnd = random.Random(seed)
+    statuses = [status for status, _ in STATUS_LIST]
+    now = datetime.now()
+    start = bench_users().count()
+    password = make_password(PASSWORD)
+    for n in range(start, start + users):
+        with database.atomic():
+            user = User.create(login=f'{LOGIN_PREFIX}{n}', password=password)
+            task_rows = []
+            for i in range(tasks):
+                created_at = now - timedelta(seconds=rnd.randint(0, 365 * 24 * 3600))
+                task_rows.append({
+                    'user': user.id,
+                    'name': f'Задача {i}',
+                    'description': 'Описание задачи ' * rnd.randint(1, 20),
+                    'status': rnd.choice(statuses),
+                    'created_at': created_at,
+                    'completion_at': created_at + timedelta(days=rnd.randint(1, 60)) if rnd.random() < 0.7 else None,
+                })
+            task_ids = []
+            for chunk in chunked(task_rows, BATCH_SIZE):
+                task_ids.extend(row[0] for row in Task.insert_many(chunk).returning(Task.id).tuples().execute())
+
+            log_rows = [
+                {'task': task_id, 'log': f'Значение поля status изменено на {rnd.choice(statuses)}',
+                 'created_at': now - timedelta(seconds=rnd.randint(0, 365 * 24 * 3600))}
+                for task_id in task_ids for _ in range(logs)
+            ]
+            for chunk in chunked(log_rows, BATCH_SIZE):
+                TaskLog.insert_many(chunk).execute()
+
+    database.execute_sql('ANALYZE "user", "task", "tasklog"')
+
+
+def clear():
+    """ Удаляем сгенерированных пользователей, задачи и история удаляются каскадом. """
+    User.delete().where(User.login.startswith(LOGIN_PREFIX)).execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор тестовых данных')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=2000, help='задач на пользователя')
+    parser.add_argument('--logs', type=int, default=3, help='записей истории на задачу')
+    parser.add_argument('--clear', action='store_true', help='удалить сгенерированные данные')
+    args = parser.parse_args()
+
+    database.init(**DATABASE)
+    with database.allow_sync():
+        if args.clear:
+            clear()
+        else:
+            seed(args.users, args.tasks, args.logs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+""" Время старта воркера и накладные расходы middleware для профилей приложения.
+
+    Для каждого профиля в отдельном процессе меряем импорт app и create_app(),
+    затем гоняем запросы к пустому обработчику через всю цепочку middleware.
+    БД не нужна: обработчики старта и остановки приложения отключаются.
+
+    python -m benchmarks.startup --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROFILES = ('production', 'development')
+
+
+async def measure_requests(app, count):
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def ping(request):
+        return web.Response(text='ok')
+
+    app.router.add_get('/bench-ping', ping)
+    app.on_startup.clear()
+    app.on_cleanup.clear()
+    async with TestClient(TestServer(app)) as client:
+        for _ in range(50):
+            await (await client.get('/bench-ping')).release()
+        start = time.perf_counter()
+        for _ in range(count):
+            await (await client.get('/bench-ping')).release()
+        elapsed = time.perf_counter() - start
+    return elapsed / count * 1e6
+
+
+def child(profile, requests):
+    start = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    app = loop.run_until_complete(app_module.create_app(profile))
+    created = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'create_app_ms': (created - imported) * 1000,
+        'modules_loaded': len(sys.modules),
+        'middlewares': len(app.middlewares),
+        'request_us': loop.run_until_complete(measure_requests(app, requests)),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--profile', choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        child(args.profile, args.requests)
+        return
+
+    result = {}
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup', '--profile', profile, '--requests', str(args.requests)],
+            check=True, stdout=subprocess.PIPE, env=dict(os.environ, APP_PROFILE=profile),
+        ).stdout
+        result[profile] = json.loads(output.decode().strip().splitlines()[-1])
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
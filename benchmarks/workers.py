@@ -0,0 +1,99 @@
+""" Масштабирование пропускной способности по числу воркеров gunicorn на одной машине.
+
+    Для каждого числа воркеров запускаем приложение через task_manager.runner,
+    гоняем сценарии benchmarks.load из нескольких клиентских процессов
+    (один клиент на asyncio сам упирается в одно ядро) и суммируем RPS.
+    Нужны данные из benchmarks.seed.
+
+    python -m benchmarks.workers --workers 1 2 4 8 --client-procs 4 --duration 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+PORT = 8765
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'{url}/pool-stats', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('приложение не запустилось')
+
+
+def start_app(workers, port):
+    env = dict(os.environ, WEB_WORKERS=str(workers), WEB_BIND=f'127.0.0.1:{port}')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:create_app', '-c', 'python:task_manager.runner'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_clients(url, args):
+    """ Запускаем client_procs процессов benchmarks.load и суммируем результаты. """
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = [os.path.join(tmp, f'{n}.json') for n in range(args.client_procs)]
+        clients = [
+            subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.load', '--url', url,
+                '--concurrency', str(args.concurrency), '--duration', str(args.duration),
+                '--users', str(args.users), '--scenarios', *args.scenarios, '--output', output,
+            ], stdout=subprocess.DEVNULL)
+            for output in outputs
+        ]
+        for client in clients:
+            client.wait()
+        results = []
+        for output in outputs:
+            with open(output) as f:
+                results.append(json.load(f)['results'])
+
+    return {
+        scenario: {
+            'rps': round(sum(result[scenario]['rps'] for result in results), 1),
+            'errors': sum(result[scenario]['errors'] for result in results),
+            'p99_ms': max(result[scenario]['p99_ms'] or 0 for result in results),
+        }
+        for scenario in args.scenarios
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Масштабирование по числу воркеров')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--client-procs', type=int, default=2, help='клиентских процессов нагрузки')
+    parser.add_argument('--concurrency', type=int, default=50, help='параллельных запросов на клиентский процесс')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--scenarios', nargs='+', default=['task_list', 'task_get'])
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{PORT}'
+    report = {}
+    for workers in args.workers:
+        app = start_app(workers, PORT)
+        try:
+            wait_ready(url)
+            report[workers] = run_clients(url, args)
+        finally:
+            app.terminate()
+            app.wait()
+
+    base = report[args.workers[0]]
+    for workers, results in report.items():
+        for scenario, result in results.items():
+            if base[scenario]['rps']:
+                result['speedup'] = round(result['rps'] / base[scenario]['rps'], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,3 @@
 #!/bin/bash
-exec gunicorn app:create_app --bind 0.0.0.0:8000 --worker-class aiohttp.GunicornWebWorker
+python -m task_manager.partitions create
+exec gunicorn app:create_app -c python:task_manager.runner
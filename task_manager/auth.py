@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from aiohttp import web
+
+from .settings import (AUTH_QUEUE_LIMIT, AUTH_WORKERS, JWT_SECRET, PASS_SALT,
+                       PBKDF2_ITERATIONS)
+
+PBKDF2_ALGORITHM = 'pbkdf2_sha256'
+# С этим хешем сверяем пароль, если логина нет: ответ занимает столько же,
+# сколько для существующего пользователя, и по времени логины не перебрать.
+DUMMY_PASSWORD = f'{PBKDF2_ALGORITHM}${PBKDF2_ITERATIONS}${"0" * 32}${"A" * 43}='
+
+
+def make_password(password, iterations=PBKDF2_ITERATIONS):
+    """ Хешируем пароль PBKDF2, результат: алгоритм$итерации$соль$хеш. """
+    salt = os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return f'{PBKDF2_ALGORITHM}${iterations}${salt}${base64.b64encode(digest).decode()}'
+
+
+def legacy_hash(password):
+    """ Старый формат: md5 от пароля с солью. Нужен только для проверки старых паролей. """
+    return hashlib.md5((password + PASS_SALT).encode()).hexdigest()
+
+
+def check_password(password, encoded):
+    """ Сравниваем пароль с хешем в любом из поддерживаемых форматов. """
+    if encoded.startswith(f'{PBKDF2_ALGORITHM}$'):
+        _, iterations, salt, digest = encoded.split('$')
+        expected = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations))
+        return hmac.compare_digest(base64.b64encode(expected).decode(), digest)
+
+    return hmac.compare_digest(legacy_hash(password), encoded)
+
+
+def needs_rehash(encoded):
+    """ Хеш в старом формате или с устаревшим числом итераций. """
+    return not encoded.startswith(f'{PBKDF2_ALGORITHM}${PBKDF2_ITERATIONS}$')
+
+
+def create_jwt(user):
+    """ Создаем токен, замешивая логин и id пользователя с секретом. """
+    return jwt.encode(
+        {"username": user.login, "user_id": user.id, "scopes": [f"username:{user.login}"]}, JWT_SECRET
+    )
+
+
+class AuthExecutor:
+    """ Хеширование паролей и подпись токенов в отдельном пуле потоков,
+        чтобы не останавливать event loop. Одновременно выполняется не
+        больше workers операций, остальные ждут в очереди длиной queue_limit.
+        Если очередь заполнена, сразу отвечаем 503.
+    """
+
+    def __init__(self, workers=AUTH_WORKERS, queue_limit=AUTH_QUEUE_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self.semaphore = asyncio.Semaphore(workers)
+        self.queue_limit = queue_limit
+        self.queued = 0
+
+    async def run(self, func, *args):
+        if self.queued >= self.queue_limit:
+            raise web.HTTPServiceUnavailable(reason='Auth queue is full', headers={'Retry-After': '1'})
+
+        self.queued += 1
+        try:
+            async with self.semaphore:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.queued -= 1
+
+    async def make_password(self, password):
+        return await self.run(make_password, password)
+
+    async def check_password(self, password, encoded):
+        return await self.run(check_password, password, encoded)
+
+    async def create_jwt(self, user):
+        return await self.run(create_jwt, user)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
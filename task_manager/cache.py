@@ -0,0 +1,217 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+
+class LRUCache:
+    """ Кэш в памяти воркера: ограничен по размеру (вытесняем давно не
+        использованные записи) и по времени жизни записи.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[1] < time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key, value, ttl=None):
+        """ set, только если живой записи с таким ключом нет. True, если записали. """
+        item = self._data.get(key)
+        if item is not None and item[1] >= time.monotonic():
+            return False
+
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryBackend:
+    """ Хранилище TaskCache в памяти воркера поверх LRUCache. """
+
+    name = 'memory'
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    @property
+    def evictions(self):
+        return self.cache.evictions
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl)
+
+    async def add(self, key, value):
+        return self.cache.add(key, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.cache.delete(key)
+
+    async def close(self):
+        self.cache.clear()
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend:
+    """ Общее для всех воркеров хранилище TaskCache в Redis.
+        Минимальный клиент протокола RESP на одном соединении: команды
+        отправляются без ожидания ответов на предыдущие, ответы приходят
+        в том же порядке и разбираются фоновой задачей.
+        Вытеснение выполняет сам Redis (maxmemory-policy), поэтому
+        evictions здесь не считаем.
+    """
+
+    name = 'redis'
+    evictions = 0
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=60, timeout=1.0):
+        url = urlsplit(url)
+        self.host = url.hostname or 'localhost'
+        self.port = url.port or 6379
+        self.db = int(url.path.lstrip('/') or 0)
+        self.password = url.password
+        self.ttl = ttl
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = deque()
+        self._connect_lock = asyncio.Lock()
+
+    async def get(self, key):
+        return await self.execute('GET', key)
+
+    async def set(self, key, value, ttl=None):
+        await self.execute('SET', key, value, 'EX', self.ttl if ttl is None else ttl)
+
+    async def add(self, key, value):
+        """ SET NX: записываем, только если ключа нет. True, если записали. """
+        return await self.execute('SET', key, value, 'EX', self.ttl, 'NX') is not None
+
+    async def delete(self, *keys):
+        if keys:
+            await self.execute('DEL', *keys)
+
+    async def execute(self, *args):
+        """ Отправляем команду и ждем ответ не дольше timeout. """
+        await self.connect()
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(self.pack(args))
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            self._read_task = asyncio.ensure_future(self._read_replies())
+            try:
+                if self.password:
+                    await self._handshake('AUTH', self.password)
+                if self.db:
+                    await self._handshake('SELECT', self.db)
+            except Exception:
+                self._writer.close()
+                raise
+
+    async def _handshake(self, *args):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(self.pack(args))
+        await asyncio.wait_for(future, self.timeout)
+
+    async def _read_replies(self):
+        """ Разбираем ответы по порядку и отдаем их ожидающим командам.
+            При обрыве соединения все ожидающие команды получают ошибку.
+        """
+        try:
+            while True:
+                reply = await self._read_reply()
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RedisError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (ConnectionError, asyncio.IncompleteReadError, RedisError) as e:
+            error = e if isinstance(e, ConnectionError) else ConnectionError(str(e))
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            self._writer.close()
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b'\r\n')
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value
+        if kind == b'-':
+            return RedisError(value.decode())
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            if value == b'-1':
+                return None
+            data = await self._reader.readexactly(int(value) + 2)
+            return data[:-2]
+        if kind == b'*':
+            if value == b'-1':
+                return None
+            return [await self._read_reply() for _ in range(int(value))]
+        raise RedisError(f'unknown reply {line!r}')
+
+    @staticmethod
+    def pack(args):
+        """ Команда в формате RESP: массив bulk-строк. """
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
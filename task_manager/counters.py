@@ -0,0 +1,80 @@
+""" Пересчет счетчиков задач (taskcounter) по данным task и tasklog.
+    Счетчики ведутся триггерами, пересчет нужен после ручных правок БД.
+    rollup сворачивает счетчики due:<дата> с прошедшей датой в overdue,
+    его выполняет фоновое обслуживание воркеров (task_manager/maintenance.py).
+
+    python -m task_manager.counters               # пересчитать для всех пользователей
+    python -m task_manager.counters --user ivan   # только для одного пользователя
+"""
+import argparse
+from datetime import date
+
+from .models import TaskCounter, User, database
+from .settings import DATABASE, logger
+
+REBUILD = """
+INSERT INTO taskcounter (user_id, key, value)
+SELECT t.user_id, k.key, count(*)
+FROM task t, task_counter_keys(t.status, t.completion_at) AS k(key)
+WHERE {where}
+GROUP BY t.user_id, k.key
+UNION ALL
+SELECT t.user_id, 'log:' || to_char(l.created_at, 'YYYY-MM-DD'), count(*)
+FROM tasklog l JOIN task t ON t.id = l.task_id
+WHERE {where}
+GROUP BY t.user_id, 2
+"""
+
+# Строки overdue меняем в порядке user_id, как и триггеры счетчиков.
+ROLLUP = """
+WITH expired AS (
+    DELETE FROM taskcounter WHERE key > 'due:' AND key < %s
+    RETURNING user_id, value
+)
+INSERT INTO taskcounter AS c (user_id, key, value)
+SELECT user_id, 'overdue', sum(value) FROM expired
+GROUP BY user_id
+ORDER BY user_id
+ON CONFLICT (user_id, key) DO UPDATE SET value = c.value + EXCLUDED.value
+"""
+
+
+def rebuild(user_id=None):
+    """ Пересчитываем счетчики в одной транзакции. На время пересчета
+        запись в task и tasklog блокируется, чтобы не потерять изменения.
+    """
+    with database.atomic():
+        database.execute_sql('LOCK TABLE "task", "tasklog" IN SHARE MODE')
+        if user_id is None:
+            TaskCounter.delete().execute()
+            database.execute_sql(REBUILD.format(where='TRUE'))
+        else:
+            TaskCounter.delete().where(TaskCounter.user == user_id).execute()
+            database.execute_sql(REBUILD.format(where='t.user_id = %s'), (user_id, user_id))
+
+
+def rollup(today=None, db=database):
+    """ Переносим счетчики due:<дата> раньше today в overdue одним запросом.
+        Новые задачи со сроком в прошлом триггеры сразу считают в overdue
+        (task_counter_keys), так что после свертки ключей due: в прошлом нет.
+    """
+    with db.atomic():
+        db.execute_sql(ROLLUP, (f'due:{today or date.today()}',))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет счетчиков задач')
+    parser.add_argument('--user', help='логин пользователя, по умолчанию все')
+    args = parser.parse_args()
+
+    database.init(**DATABASE)
+    with database.allow_sync():
+        user_id = None
+        if args.user:
+            user_id = User.get(User.login == args.user).id
+        rebuild(user_id)
+    logger.info('Счетчики задач пересчитаны')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+import asyncio
+import time
+import weakref
+from contextvars import ContextVar
+
+import peewee
+import peewee_async
+from psycopg2.errors import DuplicatePreparedStatement, InvalidSqlStatementName
+
+
+class PoolConnection(peewee_async.AsyncPostgresqlConnection):
+    """ Пул соединений aiopg с таймаутом ожидания свободного соединения.
+        Считаем ожидающих и время ожидания, чтобы подбирать размер пула.
+    """
+
+    def __init__(self, *, acquire_timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0
+        self.acquired = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Имена prepared statements, уже подготовленных на каждом соединении.
+        self.prepared = weakref.WeakKeyDictionary()
+
+    async def acquire(self):
+        """ Берем соединение из пула, но ждем не дольше acquire_timeout. """
+        self.waiters += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        finally:
+            wait = time.monotonic() - start
+            self.waiters -= 1
+            self.acquired += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self):
+        """ Текущее состояние пула. """
+        pool = self.pool
+        return {
+            'min_size': pool.minsize,
+            'max_size': pool.maxsize,
+            'size': pool.size,
+            'in_use': pool.size - pool.freesize,
+            'idle': pool.freesize,
+            'waiters': self.waiters,
+            'acquired': self.acquired,
+            'acquire_wait_avg_ms': self.wait_total / self.acquired * 1000 if self.acquired else 0.0,
+            'acquire_wait_max_ms': self.wait_max * 1000,
+            'prepared_statements': sum(len(names) for names in self.prepared.values()),
+        }
+
+
+class PooledDatabase(peewee_async.PooledPostgresqlDatabase):
+    """ PooledPostgresqlDatabase с таймаутом получения соединения
+        и пересозданием простаивающих соединений (pool_recycle).
+    """
+
+    def init(self, database, **kwargs):
+        self.acquire_timeout = kwargs.pop('acquire_timeout', None)
+        self.pool_recycle = kwargs.pop('pool_recycle', -1)
+        super().init(database, **kwargs)
+        self._async_conn_cls = PoolConnection
+
+    @property
+    def connect_params_async(self):
+        kwargs = super().connect_params_async
+        kwargs.update({
+            'acquire_timeout': self.acquire_timeout,
+            'pool_recycle': self.pool_recycle,
+        })
+        return kwargs
+
+    def pool_stats(self):
+        """ Статистика пула, пока он не открыт отдаем пустой словарь. """
+        if self._async_conn is None:
+            return {}
+
+        return self._async_conn.stats()
+
+
+class Manager(peewee_async.Manager):
+    """ Manager, который замеряет каждый запрос к БД и сообщает о нем
+        подписчикам из query_hooks: hook(query, elapsed).
+    """
+
+    def __init__(self, *args, prepare=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_hooks = []
+        self.prepare = prepare
+
+    async def _timed(self, query, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.query_hooks:
+                hook(query, elapsed)
+
+    async def execute(self, query):
+        return await self._timed(query, super().execute(query))
+
+    async def count(self, query, clear_limit=False):
+        return await self._timed(query, super().count(query, clear_limit=clear_limit))
+
+    async def scalar(self, query, as_tuple=False):
+        return await self._timed(query, super().scalar(query, as_tuple=as_tuple))
+
+    async def prepared(self, statement, **values):
+        """ Выполняем скомпилированный шаблон statement (см. queries.py)
+            с параметрами values, строки отдаем словарями.
+        """
+        bound = statement.bind(values)
+        return await self._timed(bound, self._execute_prepared(bound))
+
+    async def _execute_prepared(self, bound):
+        """ На соединении, где шаблон еще не подготовлен, сначала PREPARE.
+            Соединение то же, что и у остальных запросов: внутри транзакции
+            ее соединение, иначе любое свободное из пула.
+            С prepare=False отправляем текст шаблона с параметрами.
+        """
+        database = self.database
+        with peewee.__exception_wrapper__:
+            cursor = await database.cursor_async()
+            try:
+                if not self.prepare:
+                    await cursor.execute(bound.statement.plain_sql, bound.plain_params())
+                else:
+                    prepared = database._async_conn.prepared.setdefault(cursor.connection, set())
+                    if bound.statement.name not in prepared:
+                        await self._prepare(cursor, bound)
+                        prepared.add(bound.statement.name)
+                    try:
+                        await cursor.execute(bound.execute_sql(), bound.params)
+                    except InvalidSqlStatementName:
+                        prepared.discard(bound.statement.name)
+                        raise
+                rows = await cursor.fetchall()
+            finally:
+                await cursor.release()
+
+        columns = bound.statement.columns
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def _prepare(self, cursor, bound):
+        """ PREPARE шаблона. Если PREPARE уже прошел, но ответ потерялся
+            (отмена запроса), получим DuplicatePreparedStatement - это не ошибка.
+            Внутри транзакции ошибка прервала бы ее целиком, поэтому там
+            PREPARE выполняем в точке сохранения и при ошибке откатываемся к ней.
+        """
+        if self.database.transaction_depth_async() == 0:
+            try:
+                await cursor.execute(bound.prepare_sql())
+            except DuplicatePreparedStatement:
+                pass
+            return
+
+        await cursor.execute('SAVEPOINT prepare_statement')
+        try:
+            await cursor.execute(bound.prepare_sql())
+        except DuplicatePreparedStatement:
+            await cursor.execute('ROLLBACK TO SAVEPOINT prepare_statement')
+        await cursor.execute('RELEASE SAVEPOINT prepare_statement')
+
+
+async def execute_returning(objects, query):
+    """ Выполняем INSERT/UPDATE/DELETE ... RETURNING и отдаем все строки словарями.
+        peewee_async для INSERT отдает только первую строку RETURNING,
+        а для DELETE только число строк, поэтому выполняем запрос как raw.
+    """
+    sql, params = query.sql()
+    return list(await objects.execute(query.model.raw(sql, *params).dicts()))
+
+
+# Список действий, отложенных до коммита внешней транзакции (см. /batch).
+after_commit = ContextVar('after_commit', default=None)
+
+
+async def on_commit(func, *args, rollback=False):
+    """ Выполняем func(*args) после коммита: сразу, если внешней транзакции нет,
+        иначе откладываем до ее завершения. Так буфер истории не получает
+        записей, которые еще могут откатиться. rollback=True - выполнить
+        и после отката: сброс кэша нужен в обоих случаях, внутри транзакции
+        в кэш могла попасть незакоммиченная версия задачи.
+    """
+    pending = after_commit.get()
+    if pending is None:
+        return await func(*args)
+
+    pending.append((func, args, rollback))
+
+
+async def run_pending(pending, committed):
+    """ Выполняем отложенные on_commit действия после коммита или отката. """
+    for func, args, rollback in pending:
+        if committed or rollback:
+            await func(*args)
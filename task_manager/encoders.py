@@ -0,0 +1,21 @@
+import orjson
+from aiohttp import web
+
+
+def dumps(data):
+    """ Сериализуем в JSON через orjson, даты отдаем в формате ISO. """
+    return orjson.dumps(data, default=str)
+
+
+def json_response(data=None, *, status=200, **kwargs):
+    """ Замена web.json_response: кодируем данные один раз сразу в байты. """
+    return web.Response(body=dumps(data), status=status,
+                        content_type='application/json', **kwargs)
+
+
+def json_error(exception, error, **kwargs):
+    """ HTTP-исключение aiohttp с телом {"error": error} в JSON. """
+    exc = exception(**kwargs)
+    exc.body = dumps({'error': error})
+    exc.content_type = 'application/json'
+    return exc
@@ -0,0 +1,131 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager, suppress
+
+import aiopg
+import orjson
+import peewee
+
+from .settings import (DATABASE, EVENTS_HEARTBEAT, EVENTS_MAX_IDS,
+                       EVENTS_QUEUE_SIZE, logger)
+
+CHANNEL = 'task_events'
+# Удаление пользователя или смена логина, payload - старый логин (миграция 0009).
+USER_CHANNEL = 'user_events'
+
+
+def notify(user_id, event, ids, max_ids=EVENTS_MAX_IDS):
+    """ Выражение pg_notify с событием по задачам пользователя.
+        Уведомление уходит подписчикам только после коммита транзакции.
+        Больше max_ids задач в событие не помещаем: вместо списка
+        ids: null и count, клиенту стоит перечитать список задач.
+    """
+    ids = list(ids)
+    data = {'user': user_id, 'event': event, 'ids': ids}
+    if len(ids) > max_ids:
+        data.update(ids=None, count=len(ids))
+    payload = orjson.dumps(data).decode()
+    return peewee.fn.pg_notify(CHANNEL, payload)
+
+
+class TaskEvents:
+    """ Лента изменений задач воркера. Одно соединение с LISTEN на воркер
+        (открывается при первом подписчике или через listen_to), события
+        раздаются подписчикам пользователя. На том же соединении слушаются
+        и каналы из listen_to. У каждого подписчика своя ограниченная очередь:
+        если клиент не успевает читать, вместо очередного события он
+        получает None и отключается, чтобы не копить события в памяти.
+    """
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE, heartbeat=EVENTS_HEARTBEAT):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.subscribers = defaultdict(set)
+        self.received = 0
+        self.dropped = 0
+        # Установлен, пока соединение слушает канал.
+        self.ready = asyncio.Event()
+        self.handlers = {CHANNEL: self.publish}
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.listen())
+
+    def listen_to(self, channel, handler):
+        """ Вызываем handler(payload) на каждое уведомление канала channel,
+            соединение открываем сразу.
+        """
+        self.handlers[channel] = handler
+        self.start()
+
+    @contextmanager
+    def subscribe(self, user_id):
+        """ Очередь событий пользователя на время подключения клиента. """
+        self.start()
+
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers[user_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[user_id].discard(queue)
+            if not self.subscribers[user_id]:
+                del self.subscribers[user_id]
+
+    def publish(self, payload):
+        """ Раздаем событие подписчикам его пользователя. """
+        event = orjson.loads(payload)
+        self.received += 1
+        for queue in self.subscribers.get(event.pop('user'), ()):
+            if queue.full():
+                continue
+            if queue.qsize() == self.queue_size - 1:
+                # Последнее место в очереди - сигнал клиенту отключиться.
+                queue.put_nowait(None)
+                self.dropped += 1
+            else:
+                queue.put_nowait(event)
+
+    async def listen(self):
+        """ Держим соединение с LISTEN, при обрыве переподключаемся.
+            Пока уведомлений нет, раз в heartbeat проверяем соединение.
+        """
+        while True:
+            try:
+                async with aiopg.connect(**DATABASE) as conn:
+                    async with conn.cursor() as cur:
+                        for channel in self.handlers:
+                            await cur.execute(f'LISTEN {channel}')
+                        self.ready.set()
+                        while True:
+                            try:
+                                message = await asyncio.wait_for(conn.notifies.get(), self.heartbeat)
+                            except asyncio.TimeoutError:
+                                await cur.execute('SELECT 1')
+                            else:
+                                self.handlers[message.channel](message.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Соединение LISTEN потеряно, переподключаемся')
+                await asyncio.sleep(1)
+            finally:
+                self.ready.clear()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    def collector(self):
+        """ Состояние ленты событий как метрики. """
+        def collect():
+            return [
+                ('task_events_subscribers', 'gauge',
+                 [((), sum(len(queues) for queues in self.subscribers.values()))]),
+                ('task_events_received_total', 'counter', [((), self.received)]),
+                ('task_events_dropped_clients_total', 'counter', [((), self.dropped)]),
+            ]
+        return collect
@@ -0,0 +1,50 @@
+from aiohttp import web
+
+from .cache import LRUCache
+from .models import User
+from .queries import USER_BY_LOGIN, USER_BY_LOGIN_AND_ID
+from .settings import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL
+
+identity_cache = LRUCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+
+
+async def get_user(request):
+    """ Получаем пользователя из токена в request["user"].
+        Пользователь кэшируется по логину, запись из кэша подходит только
+        если id в токене совпадает с закэшированным. Старые токены без
+        user_id кэш не используют и всегда ищут пользователя по логину.
+        Найденный пользователь сохраняется в request["identity"], подзапросы
+        /batch получают его вместе с копией состояния запроса.
+        Кэш у каждого воркера свой, при удалении пользователя или смене
+        логина запись сбрасывает forget_user по уведомлению из БД.
+    """
+    if 'identity' in request:
+        return request['identity']
+
+    claims = request['user']
+    login = claims.get('username')
+    user_id = claims.get('user_id')
+    if user_id is not None:
+        user = identity_cache.get(login)
+        if user is not None and user.id == user_id:
+            request['identity'] = user
+            return user
+
+    if user_id is None:
+        rows = await request.app.objects.prepared(USER_BY_LOGIN, login=login)
+    else:
+        rows = await request.app.objects.prepared(USER_BY_LOGIN_AND_ID, login=login, id=user_id)
+    if not rows:
+        raise web.HTTPUnauthorized(reason='User not found')
+
+    user = User(**rows[0])
+    identity_cache.set(login, user)
+    request['identity'] = user
+    return user
+
+
+def forget_user(login):
+    """ Сбрасываем пользователя из кэша: вызывается на уведомления канала
+        user_events, которые шлет триггер на удаление и смену логина.
+    """
+    identity_cache.delete(login)
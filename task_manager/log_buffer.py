@@ -0,0 +1,172 @@
+import asyncio
+from collections import defaultdict, deque
+from datetime import datetime
+
+import peewee
+import psycopg2
+
+from .models import Task, TaskLog
+from .settings import (TASK_LOG_BATCH, TASK_LOG_BUFFER_SIZE,
+                       TASK_LOG_FLUSH_INTERVAL, TASK_LOG_PUT_TIMEOUT, logger)
+
+# Ошибки соединения с БД: запись повторяем, остальные ошибки БД не пройдут и при повторе.
+RETRY_ERRORS = (peewee.OperationalError, peewee.InterfaceError, psycopg2.OperationalError,
+                psycopg2.InterfaceError, OSError, asyncio.TimeoutError)
+
+
+class LogBuffer:
+    """ Отложенная запись истории задач (write-behind).
+        Записи ставятся в ограниченную очередь, фоновая задача пишет их
+        в TaskLog одним insert_many, как только набралось batch_size записей
+        или прошло interval секунд. Если очередь заполнена, запрос ждет
+        место не дольше put_timeout на все свои записи, а то, что не
+        поместилось, пишет сам одним insert_many (без гарантии: ошибка
+        только пишется в лог, изменение задачи уже закоммичено).
+        Еще не записанные в БД записи хранятся в pending по задачам,
+        чтобы история воркера сразу показывала их.
+    """
+
+    def __init__(self, objects, maxsize=TASK_LOG_BUFFER_SIZE, batch_size=TASK_LOG_BATCH,
+                 interval=TASK_LOG_FLUSH_INTERVAL, put_timeout=TASK_LOG_PUT_TIMEOUT):
+        self.objects = objects
+        self.queue = asyncio.Queue(maxsize)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.pending = defaultdict(deque)
+        self.flushed = 0
+        self.overflows = 0
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+
+    async def put(self, logs):
+        """ Ставим записи истории в очередь. Время записи фиксируем сейчас. """
+        now = datetime.now()
+        logs = [dict(log, created_at=now) for log in logs]
+        # В pending добавляем до постановки в очередь: запись может быть
+        # записана в БД раньше, чем put вернет управление.
+        for log in logs:
+            self.pending[log['task']].append(log)
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.put_timeout
+        for index, log in enumerate(logs):
+            try:
+                self.queue.put_nowait(log)
+            except asyncio.QueueFull:
+                try:
+                    await asyncio.wait_for(self.queue.put(log), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    overflow = logs[index:]
+                    self.overflows += len(overflow)
+                    self.forget(overflow)
+                    try:
+                        await self.objects.execute(TaskLog.insert_many(overflow))
+                    except Exception:
+                        logger.exception(f'Не удалось записать {len(overflow)} записей истории, отброшены')
+                    return
+
+            if self.queue.qsize() >= self.batch_size:
+                self._ready.set()
+
+    def pending_for(self, task):
+        """ Незаписанные записи истории задачи в формате ответа TaskLogs. """
+        try:
+            task = int(task)
+        except ValueError:
+            return []
+
+        return [{'id': None, 'date': log['created_at'], 'log': log['log']}
+                for log in self.pending.get(task, ())]
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._ready.clear()
+            while not self.queue.empty():
+                batch = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+                await self.flush(batch)
+
+    async def flush(self, batch):
+        """ Пишем пачку одним insert_many. Записи удаленных задач отбрасываем,
+            при ошибке соединения с БД повторяем оставшиеся записи через interval.
+        """
+        rows = list(batch)
+        while True:
+            try:
+                self.flushed += await self.write(rows)
+            except RETRY_ERRORS:
+                logger.exception('Не удалось записать историю задач, повторим')
+                await asyncio.sleep(self.interval)
+            else:
+                break
+
+        self.forget(batch)
+        for _ in batch:
+            self.queue.task_done()
+
+    def forget(self, logs):
+        for log in logs:
+            pending = self.pending[log['task']]
+            pending.remove(log)
+            if not pending:
+                del self.pending[log['task']]
+
+    async def write(self, rows):
+        """ Пишем rows, записанные и отброшенные убираем из rows, отдаем
+            число записанных. Если пачку БД не принимает, пишем по одной
+            записи и отбрасываем с сообщением в лог те, что не прошли.
+        """
+        try:
+            await self.objects.execute(TaskLog.insert_many(rows))
+        except RETRY_ERRORS:
+            raise
+        except peewee.IntegrityError:
+            rows[:] = await self.existing(rows)
+        except peewee.DatabaseError:
+            pass
+        else:
+            written = len(rows)
+            rows.clear()
+            return written
+
+        written = 0
+        while rows:
+            try:
+                await self.objects.execute(TaskLog.insert_many(rows[:1]))
+            except RETRY_ERRORS:
+                raise
+            except peewee.DatabaseError as e:
+                logger.error(f'Запись истории задачи {rows[0]["task"]} отброшена: {e}')
+            else:
+                written += 1
+            rows.pop(0)
+        return written
+
+    async def existing(self, batch):
+        """ Оставляем записи только тех задач, которые еще есть в БД. """
+        query = Task.select(Task.id).where(Task.id.in_({log['task'] for log in batch}))
+        ids = {task.id for task in await self.objects.execute(query)}
+        return [log for log in batch if log['task'] in ids]
+
+    def collector(self):
+        """ Состояние очереди истории как метрики. """
+        def collect():
+            return [
+                ('task_log_buffer_size', 'gauge', [((), self.queue.qsize())]),
+                ('task_log_buffer_flushed_total', 'counter', [((), self.flushed)]),
+                ('task_log_buffer_overflows_total', 'counter', [((), self.overflows)]),
+            ]
+        return collect
+
+    async def close(self):
+        """ Дописываем все, что осталось в очереди, и останавливаем фоновую задачу. """
+        self._ready.set()
+        await self.queue.join()
+        self._task.cancel()
@@ -0,0 +1,62 @@
+import asyncio
+from contextlib import suppress
+
+import peewee
+
+from . import counters, partitions
+from .settings import DATABASE, MAINTENANCE_INTERVAL, logger
+
+# Ключ advisory lock: обслуживание выполняет один воркер из всех.
+LOCK_KEY = 0x7461736b
+
+
+def run_once(db=None):
+    """ Одно обслуживание БД на отдельном синхронном соединении:
+        создаем секции истории наперед и сворачиваем прошедшие сроки
+        задач в счетчик overdue. Если другой воркер уже выполняет
+        обслуживание, ничего не делаем. Это соединение вне пула учтено
+        в бюджете соединений (settings.DB_RESERVED_CONNECTIONS).
+    """
+    db = db or peewee.PostgresqlDatabase(**DATABASE)
+    db.connect(reuse_if_open=True)
+    try:
+        if not db.execute_sql('SELECT pg_try_advisory_lock(%s)', (LOCK_KEY,)).fetchone()[0]:
+            return False
+        try:
+            if partitions.is_partitioned(db):
+                for name in partitions.create(db=db):
+                    logger.info(f'Создана секция {name}')
+            counters.rollup(db=db)
+        finally:
+            db.execute_sql('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+    finally:
+        db.close()
+    return True
+
+
+class Maintenance:
+    """ Периодическое обслуживание БД в фоне воркера раз в interval секунд,
+        первый раз сразу при старте. Синхронная работа с БД выполняется
+        в пуле потоков, чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, interval=MAINTENANCE_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, run_once)
+            except Exception:
+                logger.exception('Обслуживание БД не выполнено, повторим')
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
@@ -0,0 +1,153 @@
+""" Метрики приложения в текстовом формате Prometheus.
+
+    Запросы: число по маршруту, методу и статусу, гистограмма времени ответа,
+    число запросов в работе. БД: число запросов к БД и их суммарное время
+    на один HTTP запрос, по маршруту. Запись метрики - несколько обращений
+    к словарю, поэтому сбор можно держать включенным под нагрузкой.
+"""
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from aiohttp import web
+
+# Счетчики запросов к БД текущего HTTP запроса: [число, время].
+request_queries = ContextVar('request_queries', default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class Histogram:
+    """ Гистограмма с фиксированными границами. Счетчики по корзинам храним
+        не накопленными, накапливаем только при выводе.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {total}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Metrics:
+    """ Реестр метрик одного воркера. Дополнительные значения (пул соединений,
+        кэши) подключаются через collectors: функции, которые возвращают
+        список (имя, тип, [(метки, значение), ...]).
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.db_queries = {}
+        self.db_time = {}
+        self.db_queries_total = 0
+        self.db_time_total = 0.0
+        self.in_flight = 0
+        self.collectors = []
+
+    def on_query(self, query, elapsed):
+        """ Подписчик Manager.query_hooks. """
+        self.db_queries_total += 1
+        self.db_time_total += elapsed
+        stats = request_queries.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def observe_request(self, route, method, status, elapsed, queries, query_time):
+        key = (route, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        key = (route, method)
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.db_queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+            self.db_time[key] = Histogram(LATENCY_BUCKETS)
+        self.latency[key].observe(elapsed)
+        self.db_queries[key].observe(queries)
+        self.db_time[key].observe(query_time)
+
+    def render(self):
+        lines = [
+            '# TYPE http_requests_total counter',
+            *(f'http_requests_total{format_labels((("route", r), ("method", m), ("status", s)))} {v}'
+              for (r, m, s), v in self.requests.items()),
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+            '# TYPE db_queries_total counter',
+            f'db_queries_total {self.db_queries_total}',
+            '# TYPE db_query_seconds_total counter',
+            f'db_query_seconds_total {self.db_time_total}',
+        ]
+        for name, histograms in (('http_request_duration_seconds', self.latency),
+                                 ('db_queries_per_request', self.db_queries),
+                                 ('db_query_seconds_per_request', self.db_time)):
+            lines.append(f'# TYPE {name} histogram')
+            for (route, method), histogram in histograms.items():
+                lines.extend(histogram.render(name, (('route', route), ('method', method))))
+
+        for collector in self.collectors:
+            for name, kind, samples in collector():
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """ Считаем время ответа, статус и запросы к БД для каждого HTTP запроса. """
+    metrics = request.app.metrics
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else 'unmatched'
+    stats = [0, 0.0]
+    token = request_queries.set(stats)
+    metrics.in_flight += 1
+    status = 500
+    start = time.perf_counter()
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        metrics.in_flight -= 1
+        request_queries.reset(token)
+        metrics.observe_request(route, request.method, status, time.perf_counter() - start, *stats)
+
+
+def pool_collector(database):
+    """ Состояние пула соединений как метрики. """
+    def collect():
+        stats = database.pool_stats()
+        return [
+            (f'db_pool_{key}', 'counter' if key == 'acquired' else 'gauge', [((), value)])
+            for key, value in stats.items()
+        ]
+    return collect
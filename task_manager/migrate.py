@@ -0,0 +1,73 @@
+""" Применение миграций схемы БД.
+
+    python -m task_manager.migrate          # применить новые миграции
+    python -m task_manager.migrate --list   # показать состояние миграций
+"""
+import argparse
+import importlib
+import os
+
+from .models import database
+from .settings import DATABASE, logger
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATIONS_TABLE = 'schema_migrations'
+# Ключ advisory lock, чтобы миграции не запускались одновременно из нескольких контейнеров.
+MIGRATIONS_LOCK = 7215001
+
+
+def available_migrations():
+    """ Имена модулей миграций по порядку номеров. """
+    names = [
+        name[:-3] for name in os.listdir(MIGRATIONS_DIR)
+        if name.endswith('.py') and name[:4].isdigit()
+    ]
+    return sorted(names)
+
+
+def applied_migrations():
+    database.execute_sql(
+        f'CREATE TABLE IF NOT EXISTS "{MIGRATIONS_TABLE}" ('
+        '"version" VARCHAR(100) NOT NULL PRIMARY KEY, '
+        '"applied_at" TIMESTAMP NOT NULL DEFAULT now())'
+    )
+    cursor = database.execute_sql(f'SELECT "version" FROM "{MIGRATIONS_TABLE}"')
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate():
+    """ Применяем все еще не примененные миграции, каждую в своей транзакции. """
+    database.execute_sql('SELECT pg_advisory_lock(%s)', (MIGRATIONS_LOCK,))
+    try:
+        applied = applied_migrations()
+        for name in available_migrations():
+            if name in applied:
+                continue
+
+            module = importlib.import_module(f'{__package__}.migrations.{name}')
+            with database.atomic():
+                module.migrate(database)
+                database.execute_sql(
+                    f'INSERT INTO "{MIGRATIONS_TABLE}" ("version") VALUES (%s)', (name,))
+            logger.info(f'Применена миграция {name}')
+    finally:
+        database.execute_sql('SELECT pg_advisory_unlock(%s)', (MIGRATIONS_LOCK,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграции схемы БД')
+    parser.add_argument('--list', action='store_true', help='показать состояние миграций')
+    args = parser.parse_args()
+
+    database.init(**DATABASE)
+    with database.allow_sync():
+        if args.list:
+            applied = applied_migrations()
+            for name in available_migrations():
+                print(f'[{"x" if name in applied else " "}] {name}')
+        else:
+            migrate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+""" Начальная схема: пользователи, задачи и история изменений задач. """
+
+
+def migrate(database):
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "user" ('
+        '"id" SERIAL NOT NULL PRIMARY KEY, '
+        '"login" VARCHAR(50) NOT NULL, '
+        '"password" VARCHAR(100) NOT NULL)'
+    )
+    database.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "user_login" ON "user" ("login")')
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "task" ('
+        '"id" SERIAL NOT NULL PRIMARY KEY, '
+        '"user_id" INTEGER NOT NULL, '
+        '"name" VARCHAR(50) NOT NULL, '
+        '"description" TEXT NOT NULL, '
+        '"created_at" TIMESTAMP NOT NULL, '
+        '"status" VARCHAR(15) NOT NULL, '
+        '"completion_at" TIMESTAMP, '
+        'FOREIGN KEY ("user_id") REFERENCES "user" ("id") ON DELETE CASCADE)'
+    )
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "task_user_id" ON "task" ("user_id")')
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "tasklog" ('
+        '"id" SERIAL NOT NULL PRIMARY KEY, '
+        '"task_id" INTEGER NOT NULL, '
+        '"log" VARCHAR(200) NOT NULL, '
+        '"created_at" TIMESTAMP NOT NULL, '
+        'FOREIGN KEY ("task_id") REFERENCES "task" ("id") ON DELETE CASCADE)'
+    )
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "tasklog_task_id" ON "tasklog" ("task_id")')
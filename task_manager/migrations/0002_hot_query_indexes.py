@@ -0,0 +1,25 @@
+""" Составные индексы под частые запросы.
+
+    - список задач пользователя по (created_at, id), с фильтром по статусу и без;
+    - фильтр задач пользователя по completion_at;
+    - история задачи по времени.
+"""
+
+
+def migrate(database):
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_user_id_created_at_id" '
+        'ON "task" ("user_id", "created_at", "id")'
+    )
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_user_id_status_created_at_id" '
+        'ON "task" ("user_id", "status", "created_at", "id")'
+    )
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_user_id_completion_at" '
+        'ON "task" ("user_id", "completion_at")'
+    )
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "tasklog_task_id_created_at" '
+        'ON "tasklog" ("task_id", "created_at")'
+    )
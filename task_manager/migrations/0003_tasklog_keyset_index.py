@@ -0,0 +1,11 @@
+""" История задачи читается постранично по (created_at, id),
+    расширяем индекс истории до (task_id, created_at, id).
+"""
+
+
+def migrate(database):
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "tasklog_task_id_created_at_id" '
+        'ON "tasklog" ("task_id", "created_at", "id")'
+    )
+    database.execute_sql('DROP INDEX IF EXISTS "tasklog_task_id_created_at"')
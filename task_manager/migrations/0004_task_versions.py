@@ -0,0 +1,12 @@
+""" Версии для ETag: user.tasks_version меняется при любом изменении задач
+    пользователя, task.version - при изменении самой задачи.
+"""
+
+
+def migrate(database):
+    database.execute_sql(
+        'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS "tasks_version" BIGINT NOT NULL DEFAULT 0'
+    )
+    database.execute_sql(
+        'ALTER TABLE "task" ADD COLUMN IF NOT EXISTS "version" INTEGER NOT NULL DEFAULT 1'
+    )
@@ -0,0 +1,14 @@
+""" Полнотекстовый поиск по названию и описанию задачи.
+    GIN-индекс по выражению (user_id, to_tsvector(...)): btree_gin позволяет
+    держать user_id в том же индексе, поэтому поиск читает только
+    совпадения одного пользователя. Выражение должно совпадать
+    с task_manager.models.search_vector.
+"""
+
+
+def migrate(database):
+    database.execute_sql('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "task_user_id_search" ON "task" USING GIN '
+        '("user_id", to_tsvector(\'russian\', ("name" || \' \') || "description"))'
+    )
@@ -0,0 +1,116 @@
+""" Счетчики задач пользователя для /task/stats.
+
+    taskcounter(user_id, key, value), ключи:
+    - status:<статус> - задач в статусе;
+    - due:<YYYY-MM-DD> - незавершенных задач с completion_at на эту дату;
+    - log:<YYYY-MM-DD> - записей истории за день.
+
+    Счетчики ведут триггеры уровня оператора с таблицами переходов: одна
+    вставка в taskcounter на INSERT/UPDATE/DELETE любого числа задач,
+    в той же транзакции. Пересчитать заново: python -m task_manager.counters
+"""
+
+COUNTER_KEYS = """
+CREATE OR REPLACE FUNCTION task_counter_keys(status VARCHAR, completion_at TIMESTAMP)
+RETURNS SETOF TEXT LANGUAGE sql STABLE AS $$
+    SELECT 'status:' || status
+    UNION ALL
+    SELECT 'due:' || to_char(completion_at, 'YYYY-MM-DD')
+    WHERE completion_at IS NOT NULL AND status <> 'сompleted'
+$$
+"""
+
+# Изменения счетчиков применяем в порядке (user_id, key), чтобы параллельные
+# транзакции блокировали строки taskcounter в одном порядке. Пользователей,
+# удаленных в этой же транзакции (каскадное удаление задач), пропускаем.
+APPLY = """
+    INSERT INTO taskcounter AS c (user_id, key, value)
+    SELECT d.user_id, d.key, sum(d.value) FROM delta d
+    WHERE EXISTS (SELECT 1 FROM "user" u WHERE u.id = d.user_id)
+    GROUP BY d.user_id, d.key
+    HAVING sum(d.value) <> 0
+    ORDER BY d.user_id, d.key
+    ON CONFLICT (user_id, key) DO UPDATE SET value = c.value + EXCLUDED.value;
+"""
+
+TASK_TRIGGER = """
+CREATE OR REPLACE FUNCTION task_counters() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        WITH delta AS (
+            SELECT n.user_id, k.key, 1 AS value
+            FROM new_rows n, task_counter_keys(n.status, n.completion_at) AS k(key)
+        )%(apply)s
+    ELSIF TG_OP = 'UPDATE' THEN
+        WITH delta AS (
+            SELECT n.user_id, k.key, 1 AS value
+            FROM new_rows n, task_counter_keys(n.status, n.completion_at) AS k(key)
+            UNION ALL
+            SELECT o.user_id, k.key, -1 AS value
+            FROM old_rows o, task_counter_keys(o.status, o.completion_at) AS k(key)
+        )%(apply)s
+    ELSE
+        WITH delta AS (
+            SELECT o.user_id, k.key, -1 AS value
+            FROM old_rows o, task_counter_keys(o.status, o.completion_at) AS k(key)
+        )%(apply)s
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+TASKLOG_TRIGGER = """
+CREATE OR REPLACE FUNCTION tasklog_counters() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    WITH delta AS (
+        SELECT t.user_id, 'log:' || to_char(n.created_at, 'YYYY-MM-DD') AS key, 1 AS value
+        FROM new_rows n JOIN task t ON t.id = n.task_id
+    )%(apply)s
+    RETURN NULL;
+END
+$$
+"""
+
+# Начальные значения счетчиков по уже существующим данным.
+FILL = """
+INSERT INTO taskcounter (user_id, key, value)
+SELECT t.user_id, k.key, count(*)
+FROM task t, task_counter_keys(t.status, t.completion_at) AS k(key)
+GROUP BY t.user_id, k.key
+UNION ALL
+SELECT t.user_id, 'log:' || to_char(l.created_at, 'YYYY-MM-DD'), count(*)
+FROM tasklog l JOIN task t ON t.id = l.task_id
+GROUP BY t.user_id, 2
+"""
+
+
+def migrate(database):
+    database.execute_sql(
+        'CREATE TABLE IF NOT EXISTS "taskcounter" ('
+        '"user_id" INTEGER NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE, '
+        # Побайтовое сравнение ключей: по диапазонам вида 'due:' .. 'due:<дата>'
+        # читается первичный ключ, в локали по умолчанию ':' и ';' игнорировались бы.
+        '"key" VARCHAR(50) COLLATE "C" NOT NULL, '
+        '"value" BIGINT NOT NULL DEFAULT 0, '
+        'PRIMARY KEY ("user_id", "key"))'
+    )
+    database.execute_sql(COUNTER_KEYS)
+    database.execute_sql(TASK_TRIGGER % {'apply': APPLY})
+    database.execute_sql(TASKLOG_TRIGGER % {'apply': APPLY})
+    for event, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                              ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows')):
+        database.execute_sql(f'DROP TRIGGER IF EXISTS "task_counters_{event.lower()}" ON "task"')
+        database.execute_sql(
+            f'CREATE TRIGGER "task_counters_{event.lower()}" AFTER {event} ON "task" '
+            f'REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION task_counters()'
+        )
+    database.execute_sql('DROP TRIGGER IF EXISTS "tasklog_counters_insert" ON "tasklog"')
+    database.execute_sql(
+        'CREATE TRIGGER "tasklog_counters_insert" AFTER INSERT ON "tasklog" '
+        'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION tasklog_counters()'
+    )
+    database.execute_sql('LOCK TABLE "task", "tasklog" IN SHARE MODE')
+    database.execute_sql('DELETE FROM "taskcounter"')
+    database.execute_sql(FILL)
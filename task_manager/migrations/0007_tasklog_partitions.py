@@ -0,0 +1,77 @@
+""" История задач секционируется по месяцам created_at.
+
+    tasklog становится секционированной таблицей: секции tasklog_pYYYY_MM
+    и tasklog_default для записей вне созданных секций. Существующие записи
+    переносятся, создаются секции с месяца самой старой записи и на
+    TASKLOG_PARTITIONS_AHEAD месяцев вперед. Первичный ключ секционированной
+    таблицы обязан включать ключ секционирования: (id, created_at).
+    Дальнейшие секции создает и удаляет python -m task_manager.partitions
+    Если tasklog уже секционирована, повторный прогон только досоздает
+    секции (partitions.create), индекс и триггер.
+"""
+from datetime import date
+
+from .. import partitions
+from ..settings import TASKLOG_PARTITIONS_AHEAD
+
+
+def add_months(month, count):
+    month_index = month.year * 12 + month.month - 1 + count
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def migrate(database):
+    if partitions.is_partitioned(database):
+        partitions.create(TASKLOG_PARTITIONS_AHEAD, db=database)
+    else:
+        convert(database)
+    database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "tasklog_task_id_created_at_id" ON "tasklog" ("task_id", "created_at", "id")'
+    )
+    # Триггер счетчиков активности (миграция 0006) был на старой таблице.
+    database.execute_sql('DROP TRIGGER IF EXISTS "tasklog_counters_insert" ON "tasklog"')
+    database.execute_sql(
+        'CREATE TRIGGER "tasklog_counters_insert" AFTER INSERT ON "tasklog" '
+        'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION tasklog_counters()'
+    )
+
+
+def create_partitions(database, month):
+    """ Секции с месяца month по TASKLOG_PARTITIONS_AHEAD месяцев вперед от текущего. """
+    last = add_months(date.today().replace(day=1), TASKLOG_PARTITIONS_AHEAD)
+    while month <= last:
+        database.execute_sql(
+            f'CREATE TABLE IF NOT EXISTS "tasklog_p{month:%Y_%m}" PARTITION OF "tasklog" '
+            f'FOR VALUES FROM (\'{month}\') TO (\'{add_months(month, 1)}\')'
+        )
+        month = add_months(month, 1)
+
+
+def convert(database):
+    """ Переносим tasklog в секционированную таблицу. """
+    database.execute_sql('ALTER TABLE "tasklog" RENAME TO "tasklog_old"')
+    database.execute_sql('ALTER INDEX "tasklog_pkey" RENAME TO "tasklog_old_pkey"')
+    database.execute_sql('ALTER SEQUENCE "tasklog_id_seq" OWNED BY NONE')
+    database.execute_sql(
+        'CREATE TABLE "tasklog" ('
+        '"id" INTEGER NOT NULL DEFAULT nextval(\'tasklog_id_seq\'), '
+        '"task_id" INTEGER NOT NULL REFERENCES "task" ("id") ON DELETE CASCADE, '
+        '"log" VARCHAR(200) NOT NULL, '
+        '"created_at" TIMESTAMP NOT NULL, '
+        'PRIMARY KEY ("id", "created_at")'
+        ') PARTITION BY RANGE ("created_at")'
+    )
+    database.execute_sql('ALTER SEQUENCE "tasklog_id_seq" OWNED BY "tasklog"."id"')
+    database.execute_sql('CREATE TABLE "tasklog_default" PARTITION OF "tasklog" DEFAULT')
+
+    oldest = database.execute_sql('SELECT min("created_at") FROM "tasklog_old"').fetchone()[0]
+    month = date.today().replace(day=1)
+    if oldest is not None:
+        month = min(month, oldest.date().replace(day=1))
+    create_partitions(database, month)
+
+    database.execute_sql(
+        'INSERT INTO "tasklog" ("id", "task_id", "log", "created_at") '
+        'SELECT "id", "task_id", "log", "created_at" FROM "tasklog_old"'
+    )
+    database.execute_sql('DROP TABLE "tasklog_old"')
@@ -0,0 +1,37 @@
+""" Просроченные задачи в одном счетчике overdue.
+
+    Ключи due:<YYYY-MM-DD> с прошедшей датой сворачиваются в overdue
+    (task_manager.counters.rollup, по расписанию в фоне воркеров), а
+    task_counter_keys сразу относит к overdue задачи со сроком раньше
+    сегодняшнего дня. Так /task/stats читает один счетчик вместо суммы
+    всех прошедших дат.
+"""
+
+COUNTER_KEYS = """
+CREATE OR REPLACE FUNCTION task_counter_keys(status VARCHAR, completion_at TIMESTAMP)
+RETURNS SETOF TEXT LANGUAGE sql STABLE AS $$
+    SELECT 'status:' || status
+    UNION ALL
+    SELECT CASE WHEN completion_at < current_date THEN 'overdue'
+                ELSE 'due:' || to_char(completion_at, 'YYYY-MM-DD') END
+    WHERE completion_at IS NOT NULL AND status <> 'сompleted'
+$$
+"""
+
+ROLLUP = """
+WITH expired AS (
+    DELETE FROM "taskcounter" WHERE "key" > 'due:' AND "key" < 'due:' || to_char(current_date, 'YYYY-MM-DD')
+    RETURNING "user_id", "value"
+)
+INSERT INTO "taskcounter" AS c ("user_id", "key", "value")
+SELECT "user_id", 'overdue', sum("value") FROM expired
+GROUP BY "user_id"
+ORDER BY "user_id"
+ON CONFLICT ("user_id", "key") DO UPDATE SET "value" = c."value" + EXCLUDED."value"
+"""
+
+
+def migrate(database):
+    database.execute_sql(COUNTER_KEYS)
+    database.execute_sql('LOCK TABLE "task" IN SHARE MODE')
+    database.execute_sql(ROLLUP)
@@ -0,0 +1,24 @@
+""" Уведомление об удалении пользователя или смене логина.
+
+    Триггер на "user" шлет pg_notify в канал user_events со старым логином,
+    воркеры слушают канал (task_manager/events.py) и сразу сбрасывают
+    пользователя из кэша identity.
+"""
+
+USER_EVENTS = """
+CREATE OR REPLACE FUNCTION user_events() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('user_events', OLD.login);
+    RETURN NULL;
+END
+$$
+"""
+
+
+def migrate(database):
+    database.execute_sql(USER_EVENTS)
+    database.execute_sql('DROP TRIGGER IF EXISTS "user_events" ON "user"')
+    database.execute_sql(
+        'CREATE TRIGGER "user_events" AFTER DELETE OR UPDATE OF "login" ON "user" '
+        'FOR EACH ROW EXECUTE FUNCTION user_events()'
+    )
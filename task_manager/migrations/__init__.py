@@ -0,0 +1,7 @@
+""" Версионные миграции схемы БД.
+
+    Каждая миграция - модуль NNNN_название.py с функцией migrate(database).
+    Миграции применяются по порядку номеров, примененные версии хранятся
+    в таблице schema_migrations. SQL в миграциях пишем повторяемым
+    (IF NOT EXISTS), чтобы миграцию можно было безопасно прогнать повторно.
+"""
@@ -1,10 +1,10 @@
 from datetime import datetime
 
 import peewee
-import peewee_async
-import peeweedbevolve
 
-database = peewee_async.PostgresqlDatabase(None)
+from .db import PooledDatabase
+
+database = PooledDatabase(None)
 
 
 class BaseModel(peewee.Model):
@@ -24,6 +24,8 @@ STATUS_LIST = (
 class User(BaseModel):
     login = peewee.CharField(max_length=50, unique=True, verbose_name='Логин')
     password = peewee.CharField(max_length=100, verbose_name='Пароль')
+    # Меняется при каждом изменении задач пользователя, из нее строится ETag списка.
+    tasks_version = peewee.BigIntegerField(default=0, verbose_name='Версия списка задач')
 
     def __str__(self):
         return self.login
@@ -40,12 +42,51 @@ class Task(BaseModel):
         max_length=15, choices=STATUS_LIST, verbose_name='Статус')
     completion_at = peewee.DateTimeField(
         null=True, verbose_name='Дата завершения')
+    version = peewee.IntegerField(default=1, verbose_name='Версия')
 
     def __str__(self):
         return self.name
 
     class Meta:
         order_by = ('created_at', )
+        # Индексы создаются миграциями, см. task_manager/migrations.
+        indexes = (
+            (('user', 'created_at', 'id'), False),
+            (('user', 'status', 'created_at', 'id'), False),
+            (('user', 'completion_at'), False),
+        )
+
+
+# Поля задачи, которые отдаем клиенту.
+TASK_FIELDS = (
+    Task.id, Task.user, Task.name, Task.description,
+    Task.status, Task.created_at, Task.completion_at,
+)
+# Те же поля по имени, для выбора полей параметром fields.
+TASK_COLUMNS = {field.name: field for field in TASK_FIELDS}
+
+# Конфигурация полнотекстового поиска, та же что в индексе task_user_id_search.
+SEARCH_CONFIG = peewee.SQL("'russian'")
+
+
+def search_vector():
+    """ tsvector задачи, выражение совпадает с индексом из миграции 0005. """
+    return peewee.fn.to_tsvector(SEARCH_CONFIG, Task.name.concat(' ').concat(Task.description))
+
+
+def search_match(q):
+    """ Условие поиска по строке q (синтаксис websearch: слова, "фраза", -исключить). """
+    return peewee.Expression(search_vector(), '@@', peewee.fn.websearch_to_tsquery(SEARCH_CONFIG, q))
+
+
+def search_rank(q):
+    """ Релевантность для сортировки и курсора поиска. ts_rank отдает real,
+        курсор же приходит параметром double precision: real в сравнении
+        приводится к double и не равен своему же значению из курсора, на
+        границе страницы записи с таким же rank повторялись бы или терялись.
+        Поэтому rank сразу приводим к double, в ответе и в сравнении он один.
+    """
+    return peewee.fn.ts_rank(search_vector(), peewee.fn.websearch_to_tsquery(SEARCH_CONFIG, q)).cast('float8')
 
 
 class TaskLog(BaseModel):
@@ -58,8 +99,28 @@ class TaskLog(BaseModel):
     def __str__(self):
         return self.log
 
+    class Meta:
+        # Таблица секционирована по месяцам created_at, см. migrations/0007 и task_manager/partitions.py.
+        indexes = (
+            (('task', 'created_at', 'id'), False),
+        )
+
+
+def change_log(task_id, key, raw):
+    """ Запись истории об изменении поля key на введенное значение raw.
+        Значение может быть длиннее колонки log, текст обрезаем по ее длине.
+    """
+    return {'task': task_id, 'log': f'Значение поля {key} изменено на {raw}'[:TaskLog.log.max_length]}
 
-if __name__ == '__main__':
-    from settings import DATABASE
-    database.init(**DATABASE)
-    database.evolve()
+
+class TaskCounter(BaseModel):
+    """ Счетчики задач пользователя по ключам status:<статус>, due:<дата>, overdue, log:<дата>.
+        Ведутся триггерами БД (миграции 0006 и 0008), пересчет - python -m task_manager.counters
+    """
+    user = peewee.ForeignKeyField(
+        User, on_delete='CASCADE', related_name='counters', verbose_name='Пользователь')
+    key = peewee.CharField(max_length=50, verbose_name='Ключ')
+    value = peewee.BigIntegerField(default=0, verbose_name='Значение')
+
+    class Meta:
+        primary_key = peewee.CompositeKey('user', 'key')
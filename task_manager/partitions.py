@@ -0,0 +1,179 @@
+""" Месячные секции истории задач (tasklog_pYYYY_MM).
+
+    python -m task_manager.partitions --list                # секции и число записей
+    python -m task_manager.partitions create                # секции на TASKLOG_PARTITIONS_AHEAD месяцев вперед
+    python -m task_manager.partitions retain                # удалить секции старше TASKLOG_RETENTION_MONTHS
+    python -m task_manager.partitions retain --archive-dir /backup  # перед удалением выгрузить в csv.gz
+
+    create запускается при старте контейнера (start_gunicorn.sh) и периодически
+    в фоне воркеров (task_manager/maintenance.py), retain - по расписанию,
+    например раз в сутки.
+"""
+import argparse
+import gzip
+import os
+import re
+from datetime import date
+
+import peewee
+
+from .models import database
+from .settings import (DATABASE, TASKLOG_ARCHIVE_DIR, TASKLOG_PARTITIONS_AHEAD,
+                       TASKLOG_RETENTION_MONTHS, logger)
+
+PARENT = 'tasklog'
+DEFAULT = 'tasklog_default'
+PARTITION_NAME = re.compile(r'^tasklog_p(\d{4})_(\d{2})$')
+
+
+def add_months(month, count):
+    month_index = month.year * 12 + month.month - 1 + count
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARENT}_p{month:%Y_%m}'
+
+
+def partition_month(name):
+    """ Месяц секции по ее имени, None для tasklog_default и чужих таблиц. """
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def expired_partitions(names, keep_months, today=None):
+    """ Секции, все записи которых старше keep_months полных месяцев. """
+    cutoff = add_months((today or date.today()).replace(day=1), -keep_months)
+    return sorted(name for name in names if (partition_month(name) or cutoff) < cutoff)
+
+
+def is_partitioned(db=database):
+    cursor = db.execute_sql(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', (PARENT,))
+    return cursor.fetchone() is not None
+
+
+def partitions(db=database):
+    """ Имена секций tasklog. """
+    cursor = db.execute_sql(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = %s::regclass ORDER BY c.relname', (PARENT,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def create(ahead=TASKLOG_PARTITIONS_AHEAD, today=None, db=database):
+    """ Создаем недостающие секции с текущего месяца на ahead месяцев вперед.
+        Ошибка на одном месяце не мешает создать следующие.
+    """
+    month = (today or date.today()).replace(day=1)
+    existing = set(partitions(db))
+    created = []
+    for _ in range(ahead + 1):
+        name = partition_name(month)
+        if name not in existing:
+            try:
+                moved = create_partition(month, db)
+            except peewee.DatabaseError as e:
+                logger.error(f'Не удалось создать секцию {name}: {e}')
+            else:
+                if moved:
+                    logger.warning(f'В секцию {name} перенесено {moved} записей из {DEFAULT}')
+                created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def create_partition(month, db=database):
+    """ Создаем секцию месяца month, отдаем число перенесенных в нее записей.
+        Если записи этого месяца уже попали в tasklog_default (секцию вовремя
+        не создали), CREATE ... PARTITION OF упадет на проверке default секции.
+        Тогда отсоединяем default, создаем секцию, переносим в нее записи
+        и присоединяем default обратно, все в одной транзакции.
+        Вставка идет прямо в секцию, поэтому триггер счетчиков на tasklog
+        второй раз эти записи не считает.
+    """
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    with db.atomic():
+        if DEFAULT not in partitions(db):
+            db.execute_sql(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT}" '
+                           f'FOR VALUES FROM (\'{start}\') TO (\'{end}\')')
+            return 0
+
+        # Блокируем вставку в tasklog, пока проверяем и переносим записи.
+        db.execute_sql(f'LOCK TABLE "{PARENT}" IN SHARE ROW EXCLUSIVE MODE')
+        in_range = f'created_at >= \'{start}\' AND created_at < \'{end}\''
+        stray = db.execute_sql(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT}" WHERE {in_range})').fetchone()[0]
+        if not stray:
+            db.execute_sql(f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT}" '
+                           f'FOR VALUES FROM (\'{start}\') TO (\'{end}\')')
+            return 0
+
+        db.execute_sql(f'ALTER TABLE "{PARENT}" DETACH PARTITION "{DEFAULT}"')
+        db.execute_sql(f'CREATE TABLE "{name}" PARTITION OF "{PARENT}" '
+                       f'FOR VALUES FROM (\'{start}\') TO (\'{end}\')')
+        moved = db.execute_sql(
+            f'WITH moved AS (DELETE FROM "{DEFAULT}" WHERE {in_range} RETURNING *) '
+            f'INSERT INTO "{name}" SELECT * FROM moved').rowcount
+        db.execute_sql(f'ALTER TABLE "{PARENT}" ATTACH PARTITION "{DEFAULT}" DEFAULT')
+    return moved
+
+
+def archive(name, archive_dir):
+    """ Выгружаем секцию в archive_dir/<name>.csv.gz, файл появляется только целиком. """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.csv.gz')
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as f:
+        database.cursor().copy_expert(f'COPY "{name}" TO STDOUT WITH CSV HEADER', f)
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def retain(keep_months=TASKLOG_RETENTION_MONTHS, archive_dir=TASKLOG_ARCHIVE_DIR, today=None):
+    """ Отсоединяем и удаляем устаревшие секции, при archive_dir сначала выгружаем их. """
+    removed = []
+    for name in expired_partitions(partitions(), keep_months, today):
+        with database.atomic():
+            if archive_dir:
+                logger.info(f'Секция {name} выгружена в {archive(name, archive_dir)}')
+            database.execute_sql(f'ALTER TABLE "{PARENT}" DETACH PARTITION "{name}"')
+            database.execute_sql(f'DROP TABLE "{name}"')
+        removed.append(name)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Секции истории задач')
+    parser.add_argument('command', nargs='?', choices=('create', 'retain'))
+    parser.add_argument('--list', action='store_true', help='показать секции')
+    parser.add_argument('--ahead', type=int, default=TASKLOG_PARTITIONS_AHEAD,
+                        help='на сколько месяцев вперед создавать секции')
+    parser.add_argument('--keep-months', type=int, default=TASKLOG_RETENTION_MONTHS,
+                        help='сколько полных месяцев истории хранить')
+    parser.add_argument('--archive-dir', default=TASKLOG_ARCHIVE_DIR,
+                        help='куда выгружать удаляемые секции, без него секции просто удаляются')
+    args = parser.parse_args()
+
+    database.init(**DATABASE)
+    with database.allow_sync():
+        if not is_partitioned():
+            logger.warning('tasklog еще не секционирована, примените миграции: python -m task_manager.migrate')
+            return
+
+        if args.command == 'create':
+            for name in create(args.ahead):
+                logger.info(f'Создана секция {name}')
+        elif args.command == 'retain':
+            for name in retain(args.keep_months, args.archive_dir):
+                logger.info(f'Удалена секция {name}')
+        if args.list or args.command is None:
+            for name in partitions():
+                count = database.execute_sql(f'SELECT count(*) FROM "{name}"').fetchone()[0]
+                print(f'{name}\t{count}')
+
+
+if __name__ == '__main__':
+    main()
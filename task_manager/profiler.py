@@ -0,0 +1,127 @@
+""" Профилирование запросов к БД в рамках одного HTTP запроса.
+
+    Включается настройкой QUERY_PROFILER. Для каждого запроса записываем
+    все SQL запросы, прошедшие через app.objects, с временем выполнения,
+    и предупреждаем в лог о повторяющихся запросах одного вида (N+1).
+    Если в запросе есть заголовок X-Profile, сводку отдаем в заголовке
+    ответа X-Query-Profile, а с X-Profile: cprofile еще и топ функций cProfile.
+
+    Медленные запросы (дольше SLOW_QUERY_MS) пишутся в лог всегда.
+"""
+import cProfile
+import io
+import pstats
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from aiohttp import web
+
+from .encoders import dumps
+from .settings import N_PLUS_ONE_THRESHOLD, SLOW_QUERY_MS, logger
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_RESPONSE_HEADER = 'X-Query-Profile'
+MAX_REPORTED_QUERIES = 50
+MAX_SQL_LENGTH = 200
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+class QueryProfile:
+    """ SQL запросы одного HTTP запроса: (sql без параметров, время). """
+
+    def __init__(self):
+        self.queries = []
+
+    def record(self, query, elapsed):
+        self.queries.append((query.sql()[0], elapsed))
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """ Запросы одного вида, выполненные threshold и более раз. """
+        counter = Counter(sql for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counter.most_common() if count >= threshold]
+
+    def summary(self):
+        return {
+            'count': len(self.queries),
+            'time_ms': round(sum(elapsed for _, elapsed in self.queries) * 1000, 3),
+            'n_plus_one': [
+                {'sql': sql[:MAX_SQL_LENGTH], 'count': count} for sql, count in self.repeated()
+            ],
+            'queries': [
+                {'sql': sql[:MAX_SQL_LENGTH], 'ms': round(elapsed * 1000, 3)}
+                for sql, elapsed in self.queries[:MAX_REPORTED_QUERIES]
+            ],
+        }
+
+
+def profile_hook(query, elapsed):
+    """ Подписчик Manager.query_hooks: пишем запрос в профиль текущего HTTP запроса. """
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record(query, elapsed)
+
+
+def slow_query_hook(query, elapsed):
+    """ Подписчик Manager.query_hooks: логируем медленные запросы. """
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        sql, params = query.sql()
+        logger.warning(f'Медленный запрос {elapsed * 1000:.1f} мс: {sql} {params}')
+
+
+class _CProfile:
+    """ cProfile одновременно может снимать только один запрос. """
+    busy = False
+
+    def __init__(self):
+        self.profiler = None
+
+    def __enter__(self):
+        if not _CProfile.busy:
+            _CProfile.busy = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            _CProfile.busy = False
+
+    def top(self, limit=15):
+        if self.profiler is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+        lines = [line.strip() for line in stream.getvalue().splitlines() if line.strip()]
+        start = next((i for i, line in enumerate(lines) if line.startswith('ncalls')), -1) + 1
+        return lines[start:start + limit]
+
+
+@web.middleware
+async def profiler_middleware(request, handler):
+    profile = QueryProfile()
+    token = current_profile.set(profile)
+    mode = request.headers.get(PROFILE_HEADER)
+    sampler = _CProfile() if mode == 'cprofile' else None
+    start = time.perf_counter()
+    try:
+        if sampler is not None:
+            with sampler:
+                response = await handler(request)
+        else:
+            response = await handler(request)
+    finally:
+        current_profile.reset(token)
+
+    for sql, count in profile.repeated():
+        logger.warning(f'Возможный N+1 в {request.method} {request.path}: {count} раз {sql}')
+
+    if mode is not None and not response.prepared:
+        summary = profile.summary()
+        summary['request_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        if sampler is not None:
+            summary['cprofile'] = sampler.top()
+        response.headers[PROFILE_RESPONSE_HEADER] = dumps(summary).decode()
+    return response
@@ -0,0 +1,184 @@
+""" Скомпилированные SQL-шаблоны горячих запросов.
+
+    Запрос один раз строится через peewee с плейсхолдерами $1, $2, ...
+    вместо значений и компилируется в текст, на каждый HTTP запрос
+    подставляются только параметры. Manager.prepared выполняет шаблон
+    как серверный prepared statement: PREPARE на соединении пула при
+    первом использовании, дальше только EXECUTE, и Postgres не разбирает
+    и не планирует запрос заново.
+"""
+import hashlib
+import re
+from functools import lru_cache
+from types import SimpleNamespace
+
+import peewee
+
+from .models import (TASK_COLUMNS, TASK_FIELDS, Task, TaskLog, User, search_match,
+                     search_rank)
+
+PARAM = re.compile(r'%s')
+PLACEHOLDER = re.compile(r'\$(\d+)')
+
+
+def task_columns(field_names):
+    """ Колонки для SELECT: все поля задачи или только запрошенные в fields,
+        id и created_at читаем всегда, они нужны для курсора.
+    """
+    if not field_names:
+        return TASK_FIELDS
+
+    return [TASK_COLUMNS[key] for key in dict.fromkeys(('id', 'created_at', *field_names))]
+
+
+def filter_tasks(query, data):
+    """ Фильтры списка задач: status, completion_at и полнотекстовый поиск q. """
+    if data.status:
+        query = query.where(Task.status == data.status)
+
+    if data.completion_at:
+        query = query.where(Task.completion_at >= data.completion_at)
+
+    if data.q:
+        query = query.where(search_match(data.q))
+
+    return query
+
+
+def search_page(user_id, data, limit):
+    """ Страница поиска, как в TaskSearchAPI.get: по убыванию rank,
+        после курсора data.after (rank, id).
+    """
+    rank = search_rank(data.q)
+    query = Task.select(*task_columns(data.field_names), rank.alias('rank')).where(Task.user == user_id)
+    query = filter_tasks(query, data)
+    if data.after:
+        query = query.where(peewee.Tuple(rank, Task.id) < peewee.Tuple(*data.after))
+
+    return query.order_by(rank.desc(), Task.id.desc()).limit(limit)
+
+
+def log_page(task_id, since, limit, from_date=None):
+    """ Порция истории после позиции since по индексу (task, created_at, id).
+        Отдельное условие на created_at нужно, чтобы Postgres отбросил
+        месячные секции tasklog раньше since, по сравнению пар он этого не делает.
+        Так же from_date отсекает секции уже на первой странице.
+    """
+    query = (TaskLog.select(TaskLog.id, TaskLog.created_at.alias('date'), TaskLog.log)
+             .where(TaskLog.task == task_id))
+    if from_date:
+        query = query.where(TaskLog.created_at >= from_date)
+    if since:
+        query = query.where(TaskLog.created_at >= since[0],
+                            peewee.Tuple(TaskLog.created_at, TaskLog.id) > peewee.Tuple(*since))
+
+    return query.order_by(TaskLog.created_at, TaskLog.id).limit(limit)
+
+
+class Params:
+    """ Плейсхолдеры $1, $2, ... для шаблона, по порядку добавления. """
+
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, name):
+        self.names.append(name)
+        return peewee.SQL(f'${len(self.names)}')
+
+
+def literal(value):
+    """ Константа запроса как литерал SQL. """
+    if isinstance(value, str):
+        return "'%s'" % value.replace("'", "''")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    raise TypeError(f'unsupported constant in statement: {value!r}')
+
+
+class Statement:
+    """ Скомпилированный запрос: текст с $n, имена параметров и колонок результата.
+        Константы, которые peewee передает параметрами (например, ' ' в
+        search_vector), подставляются в текст литералами: иначе выражение
+        не совпадет с выражением индекса task_user_id_search.
+    """
+
+    def __init__(self, query, params):
+        sql, constants = query.sql()
+        constants = iter(constants)
+        self.sql = PARAM.sub(lambda match: literal(next(constants)), sql)
+        self.params = params.names
+        self.columns = [getattr(column, '_alias', None) or column.name for column in query._returning]
+        self.name = 'q_' + hashlib.sha1(self.sql.encode()).hexdigest()[:16]
+        # Тот же запрос для psycopg2 без PREPARE: $n -> %(pn)s.
+        self.plain_sql = PLACEHOLDER.sub(r'%(p\1)s', self.sql.replace('%', '%%'))
+
+    def bind(self, values):
+        """ Запрос с параметрами из словаря values. """
+        return BoundStatement(self, [values[name] for name in self.params])
+
+
+class BoundStatement:
+    """ Шаблон с параметрами. sql() как у запросов peewee, для Manager.query_hooks. """
+
+    def __init__(self, statement, params):
+        self.statement = statement
+        self.params = params
+
+    def sql(self):
+        return self.statement.sql, self.params
+
+    def prepare_sql(self):
+        return f'PREPARE {self.statement.name} AS {self.statement.sql}'
+
+    def execute_sql(self):
+        if not self.params:
+            return f'EXECUTE {self.statement.name}'
+
+        return f'EXECUTE {self.statement.name}({", ".join(["%s"] * len(self.params))})'
+
+    def plain_params(self):
+        return {f'p{number}': value for number, value in enumerate(self.params, 1)}
+
+
+def compile_statement(build):
+    """ Statement из функции build(p), которая строит запрос peewee
+        с плейсхолдерами p('имя') вместо значений.
+    """
+    params = Params()
+    return Statement(build(params), params)
+
+
+USER_BY_LOGIN = compile_statement(
+    lambda p: User.select(User.id, User.login).where(User.login == p('login')))
+
+USER_BY_LOGIN_AND_ID = compile_statement(
+    lambda p: User.select(User.id, User.login).where(User.login == p('login'), User.id == p('id')))
+
+TASKS_VERSION = compile_statement(
+    lambda p: User.select(User.tasks_version).where(User.id == p('user')))
+
+TASK_BY_ID = compile_statement(
+    lambda p: Task.select(*TASK_FIELDS, Task.version).where(Task.id == p('id')))
+
+
+@lru_cache(maxsize=512)
+def task_page(fields, status, completion_at, q, after):
+    """ Страница списка задач, как в TaskAPI.get: свой шаблон на каждое
+        сочетание полей fields (отсортированный кортеж или None) и
+        использованных фильтров. Параметры: user, status, completion_at,
+        q, after_created_at, after_id и limit.
+    """
+    def build(p):
+        query = Task.select(*task_columns(fields)).where(Task.user == p('user'))
+        data = SimpleNamespace(
+            status=status and p('status'),
+            completion_at=completion_at and p('completion_at'),
+            q=q and p('q'),
+        )
+        query = filter_tasks(query, data)
+        if after:
+            query = query.where(peewee.Tuple(Task.created_at, Task.id)
+                                > peewee.Tuple(p('after_created_at'), p('after_id')))
+        return query.order_by(Task.created_at, Task.id).limit(p('limit'))
+
+    return compile_statement(build)
@@ -0,0 +1,28 @@
+""" Настройки gunicorn для production: воркеры aiohttp на uvloop,
+    число воркеров по числу ядер, keep-alive, backlog и перезапуск
+    воркеров после max_requests запросов (с разбросом, чтобы не все сразу).
+
+    gunicorn app:create_app -c python:task_manager.runner
+
+    Размер пула соединений с БД каждого воркера считается в settings
+    из DB_CONNECTIONS_BUDGET и WEB_WORKERS.
+"""
+from .settings import (DB_CONNECTIONS_BUDGET, DB_POOL, DB_RESERVED_CONNECTIONS,
+                       WEB_BACKLOG, WEB_BIND, WEB_GRACEFUL_TIMEOUT,
+                       WEB_KEEPALIVE, WEB_MAX_REQUESTS, WEB_MAX_REQUESTS_JITTER,
+                       WEB_WORKERS)
+
+bind = WEB_BIND
+workers = WEB_WORKERS
+worker_class = 'aiohttp.GunicornUVLoopWebWorker'
+keepalive = WEB_KEEPALIVE
+backlog = WEB_BACKLOG
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS_JITTER
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+
+
+def on_starting(server):
+    server.log.info(
+        f'Воркеров: {workers}, пул БД на воркер: {DB_POOL["max_connections"]} '
+        f'(+{DB_RESERVED_CONNECTIONS} вне пула), бюджет соединений: {DB_CONNECTIONS_BUDGET}')
@@ -12,6 +12,10 @@ if DEBUG:
 else:
     load_dotenv()
 
+# development - отладочная панель, валидация apispec и Swagger на /docs,
+# production - минимальный набор middleware.
+APP_PROFILE = os.getenv('APP_PROFILE', 'development' if DEBUG else 'production')
+
 JWT_SECRET = os.getenv('JWT_SECRET')
 PASS_SALT = os.getenv('PASS_SALT')
 
@@ -22,6 +26,111 @@ DATABASE = {
     'host': os.getenv('DB_HOST'),
 }
 
+# Воркеры gunicorn (task_manager/runner.py), по умолчанию по числу доступных ядер.
+WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:8000')
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 0)) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count())
+WEB_KEEPALIVE = int(os.getenv('WEB_KEEPALIVE', 75))
+WEB_BACKLOG = int(os.getenv('WEB_BACKLOG', 2048))
+WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 10000))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 1000))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+
+# Фоновое обслуживание БД (task_manager/maintenance.py) раз в MAINTENANCE_INTERVAL секунд,
+# 0 - отключено. На время обслуживания воркер открывает одно отдельное соединение.
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 3600))
+
+# Сколько соединений с Postgres могут занять все воркеры вместе (max_connections
+# сервера за вычетом запаса на миграции и администрирование). Бюджет делится
+# поровну между WEB_WORKERS, DB_RESERVED_CONNECTIONS соединений воркера вне пула
+# (LISTEN /task/events и соединение обслуживания), остальное - пул. Если бюджета не хватает даже на пул
+# из одного соединения на воркер, не стартуем: иначе бюджет молча превышается.
+DB_CONNECTIONS_BUDGET = int(os.getenv('DB_CONNECTIONS_BUDGET', 90))
+DB_RESERVED_CONNECTIONS = 2 if MAINTENANCE_INTERVAL else 1
+if DB_CONNECTIONS_BUDGET < WEB_WORKERS * (1 + DB_RESERVED_CONNECTIONS):
+    raise ValueError(
+        f'DB_CONNECTIONS_BUDGET={DB_CONNECTIONS_BUDGET} меньше, чем нужно {WEB_WORKERS} воркерам '
+        f'({WEB_WORKERS * (1 + DB_RESERVED_CONNECTIONS)}): уменьшите WEB_WORKERS или увеличьте бюджет')
+DB_POOL_MAX_SIZE = min(int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                       DB_CONNECTIONS_BUDGET // WEB_WORKERS - DB_RESERVED_CONNECTIONS)
+
+# Пул соединений с БД на один воркер.
+DB_POOL = {
+    'min_connections': min(int(os.getenv('DB_POOL_MIN_SIZE', 2)), DB_POOL_MAX_SIZE),
+    'max_connections': DB_POOL_MAX_SIZE,
+    'acquire_timeout': float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 5)),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 600)),
+}
+
+# Горячие запросы (queries.py) как серверные prepared statements на каждом соединении пула.
+# Выключите (0) за pgbouncer в режиме transaction, там соединение сервера не закреплено за клиентом.
+PREPARED_STATEMENTS = os.getenv('PREPARED_STATEMENTS', '1') == '1'
+
+# Хеширование паролей и выдача токенов выполняются в пуле потоков.
+AUTH_WORKERS = int(os.getenv('AUTH_WORKERS', 2))
+AUTH_QUEUE_LIMIT = int(os.getenv('AUTH_QUEUE_LIMIT', 64))
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', 260000))
+
+# Кэш пользователей, определенных по токену (на один воркер).
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', 60))
+
+# Кэш задач: memory - свой у каждого воркера, redis - общий для всех воркеров.
+TASK_CACHE = os.getenv('TASK_CACHE', 'memory')
+TASK_CACHE_URL = os.getenv('TASK_CACHE_URL', 'redis://localhost:6379/0')
+TASK_CACHE_SIZE = int(os.getenv('TASK_CACHE_SIZE', 10000))
+TASK_CACHE_TTL = int(os.getenv('TASK_CACHE_TTL', 300))
+# Сколько секунд после изменения задача не кладется в кэш: дольше любого чтения задачи из БД.
+TASK_CACHE_TOMBSTONE_TTL = int(os.getenv('TASK_CACHE_TOMBSTONE_TTL', 10))
+
+# Постраничный вывод списка задач и истории изменений.
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 500))
+
+# Сколько записей истории читать из БД за раз при потоковой выдаче.
+LOG_STREAM_CHUNK = int(os.getenv('LOG_STREAM_CHUNK', 500))
+
+# Месячные секции истории (task_manager/partitions.py): сколько месяцев создавать
+# вперед, сколько полных месяцев хранить и куда выгружать удаляемые секции.
+TASKLOG_PARTITIONS_AHEAD = int(os.getenv('TASKLOG_PARTITIONS_AHEAD', 3))
+TASKLOG_RETENTION_MONTHS = int(os.getenv('TASKLOG_RETENTION_MONTHS', 12))
+TASKLOG_ARCHIVE_DIR = os.getenv('TASKLOG_ARCHIVE_DIR', '')
+
+# Отложенная запись истории (TASK_LOG_BUFFER=1): очередь на воркер, запись пачками
+# по TASK_LOG_BATCH или раз в TASK_LOG_FLUSH_INTERVAL секунд.
+TASK_LOG_BUFFER = os.getenv('TASK_LOG_BUFFER', '0') == '1'
+TASK_LOG_BUFFER_SIZE = int(os.getenv('TASK_LOG_BUFFER_SIZE', 10000))
+TASK_LOG_BATCH = int(os.getenv('TASK_LOG_BATCH', 500))
+TASK_LOG_FLUSH_INTERVAL = float(os.getenv('TASK_LOG_FLUSH_INTERVAL', 0.5))
+TASK_LOG_PUT_TIMEOUT = float(os.getenv('TASK_LOG_PUT_TIMEOUT', 1))
+
+# Лента изменений задач /task/events: очередь событий на клиента и интервал heartbeat, сек.
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', 100))
+EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', 15))
+# Сколько id задач передавать в одном событии, больше - только их число:
+# payload pg_notify ограничен 8000 байт, иначе откатится сама запись задач.
+EVENTS_MAX_IDS = int(os.getenv('EVENTS_MAX_IDS', 500))
+
+# Статистика /task/stats: сколько дней вперед считать "скоро срок" и сколько дней активности отдавать.
+STATS_DUE_SOON_DAYS = int(os.getenv('STATS_DUE_SOON_DAYS', 3))
+STATS_ACTIVITY_DAYS = int(os.getenv('STATS_ACTIVITY_DAYS', 7))
+
+# Максимальный размер тела запроса, байт: любого и при создании/изменении одной задачи.
+MAX_BODY_SIZE = int(os.getenv('MAX_BODY_SIZE', 1024 ** 2))
+TASK_BODY_MAX_SIZE = int(os.getenv('TASK_BODY_MAX_SIZE', 64 * 1024))
+
+# Максимум задач в одном запросе к /task/bulk.
+BULK_MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', 500))
+
+# /batch: максимум операций в одном запросе и общий таймаут их выполнения, сек.
+BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS', 20))
+BATCH_TIMEOUT = float(os.getenv('BATCH_TIMEOUT', 10))
+
+# Профилирование запросов к БД (QUERY_PROFILER=1) и лог медленных запросов.
+QUERY_PROFILER = os.getenv('QUERY_PROFILER', '0') == '1'
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 3))
+
 logger_config = {
     'version': 1,
     'disable_exsisting_logger': False,
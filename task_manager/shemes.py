@@ -1,11 +1,20 @@
-import json
 from datetime import datetime
+from typing import Any, Dict
 
-from pydantic import BaseModel, Field, constr, validator
+import orjson
+from pydantic import BaseModel, Field, conint, conlist, constr, validator
+
+from .models import STATUS_LIST, TASK_COLUMNS
+from .settings import (BATCH_MAX_OPERATIONS, BULK_MAX_ITEMS, MAX_PAGE_SIZE,
+                       PAGE_SIZE)
+from .utils import decode_cursor, decode_rank_cursor
+
+
+STATUSES = [status for status, _ in STATUS_LIST]
 
 
 def orjson_dumps(v, *, default):
-    return json.dumps(v, default=default, ensure_ascii=False)
+    return orjson.dumps(v, default=default).decode()
 
 
 class UserSchema(BaseModel):
@@ -21,9 +30,8 @@ class FilterTask(BaseModel):
 
     @validator('status')
     def check_status(cls, v):
-        status_list = [None, 'new', 'planned', 'in_work', 'сompleted']
-        if not v in status_list:
-            raise ValueError('Не корректный статус! available values(new, planned, in_work, сompleted)')
+        if v is not None and v not in STATUSES:
+            raise ValueError(f'Не корректный статус! available values({", ".join(STATUSES)})')
 
         return v
 
@@ -43,6 +51,77 @@ class FilterTask(BaseModel):
         json_dumps = orjson_dumps
 
 
+class PageSchema(BaseModel):
+    limit: conint(gt=0) = PAGE_SIZE
+
+    @validator('limit')
+    def check_limit(cls, v):
+        return min(v, MAX_PAGE_SIZE)
+
+
+class FieldsSchema(BaseModel):
+    # fields занято в BaseModel, поэтому параметр fields читаем в field_names.
+    field_names: str = Field(None, alias='fields')
+
+    @validator('field_names')
+    def check_fields(cls, v):
+        """ Поля задачи через запятую, допустимы только поля из TASK_COLUMNS. """
+        if v is not None:
+            fields = tuple(dict.fromkeys(field.strip() for field in v.split(',') if field.strip()))
+            if not fields or not set(fields) <= TASK_COLUMNS.keys():
+                raise ValueError(f'incorrect fields, available values({", ".join(TASK_COLUMNS)})')
+
+            return fields
+
+        return v
+
+
+class PageTask(PageSchema, FilterTask, FieldsSchema):
+    q: constr(max_length=200) = None
+    after: str = None
+
+    @validator('after')
+    def check_after(cls, v):
+        if v is not None:
+            return decode_cursor(v)
+
+        return v
+
+
+class SearchTask(PageSchema, FilterTask, FieldsSchema):
+    q: constr(strip_whitespace=True, min_length=1, max_length=200)
+    after: str = None
+
+    @validator('after')
+    def check_after(cls, v):
+        if v is not None:
+            return decode_rank_cursor(v)
+
+        return v
+
+
+class PageLog(PageSchema):
+    since: str = None
+    from_date: str = None
+
+    @validator('since')
+    def check_since(cls, v):
+        if v is not None:
+            return decode_cursor(v)
+
+        return v
+
+    @validator('from_date')
+    def check_from_date(cls, v):
+        if v is not None:
+            try:
+                return datetime.strptime(v, '%d-%m-%Y')
+            except ValueError:
+                raise ValueError('incorrect from_date format (%d-%m-%Y)')
+
+        return v
+
+
 class TaskSchema(FilterTask, BaseModel):
     user: int
     name: constr(max_length=50)
@@ -63,12 +142,17 @@ class PutTaskSchema(FilterTask, BaseModel):
         json_dumps = orjson_dumps
 
 
-class GetTaskSchema( BaseModel):
-    user: int
-    name: constr()
-    description: constr()
-    status: constr()
-    completion_at: datetime = None
+class BulkIdsSchema(BaseModel):
+    ids: conlist(int, min_items=1, max_items=BULK_MAX_ITEMS)
 
-    class Config:
-        json_dumps = orjson_dumps
+
+class BatchOperation(BaseModel):
+    method: constr(regex='^(GET|POST|PUT|DELETE)$')
+    path: constr(regex='^/', max_length=2000)
+    json_body: Any = Field(None, alias='json')
+    data: Dict[str, str] = None
+
+
+class BatchSchema(BaseModel):
+    atomic: bool = False
+    operations: conlist(BatchOperation, min_items=1, max_items=BATCH_MAX_OPERATIONS)
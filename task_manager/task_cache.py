@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+
+from .cache import MemoryBackend, RedisBackend, RedisError
+from .db import after_commit
+from .encoders import dumps
+from .queries import TASK_BY_ID
+from .settings import (TASK_CACHE, TASK_CACHE_SIZE, TASK_CACHE_TOMBSTONE_TTL,
+                       TASK_CACHE_TTL, TASK_CACHE_URL, logger)
+
+DATE_FIELDS = ('created_at', 'completion_at')
+# Значение-метка сброшенной задачи, см. TaskCache.invalidate.
+TOMBSTONE = b'-'
+
+
+class TaskCache:
+    """ Кэш задач по id со сквозным чтением: при промахе читаем задачу
+        из БД и кладем в кэш. После изменения или удаления задачи
+        запись сбрасывается через invalidate (после коммита транзакции).
+        Задача хранится словарем: поля TASK_FIELDS и version.
+        invalidate не удаляет ключ, а пишет метку TOMBSTONE на tombstone_ttl
+        секунд, а заполнение после промаха пишет только в отсутствующий ключ
+        (add, SET NX). Так запрос, прочитавший задачу из БД до изменения,
+        не вернет в кэш старую версию после сброса.
+        Внутри транзакции /batch (установлен after_commit) кэш не используется:
+        задача читается из БД, как ее видит сама транзакция, и в кэш не пишется.
+        Ошибки хранилища не ломают запрос, считаем их промахом.
+    """
+
+    def __init__(self, backend, tombstone_ttl=TASK_CACHE_TOMBSTONE_TTL):
+        self.backend = backend
+        self.tombstone_ttl = tombstone_ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, objects, task_id):
+        """ Задача словарем или None, если такой нет. """
+        try:
+            task_id = int(task_id)
+        except ValueError:
+            return None
+
+        if after_commit.get() is not None:
+            rows = await objects.prepared(TASK_BY_ID, id=task_id)
+            return rows[0] if rows else None
+
+        key = self.key(task_id)
+        raw = await self._call(self.backend.get(key))
+        if raw is not None and raw != TOMBSTONE:
+            self.hits += 1
+            return self.loads(raw)
+
+        self.misses += 1
+        rows = await objects.prepared(TASK_BY_ID, id=task_id)
+        if not rows:
+            return None
+
+        task = rows[0]
+        if raw is None:
+            await self._call(self.backend.add(key, dumps(task)))
+        return task
+
+    async def invalidate(self, *task_ids):
+        """ Сбрасываем задачи из кэша: ставим метку, пока она жива, задача
+            читается из БД и в кэш не попадает.
+        """
+        for task_id in task_ids:
+            await self._call(self.backend.set(self.key(task_id), TOMBSTONE, self.tombstone_ttl))
+
+    async def close(self):
+        await self.backend.close()
+
+    async def _call(self, coro):
+        try:
+            return await coro
+        except (OSError, asyncio.TimeoutError, RedisError) as e:
+            self.errors += 1
+            logger.warning(f'Кэш задач недоступен: {e!r}')
+            return None
+
+    @staticmethod
+    def key(task_id):
+        return f'task:{task_id}'
+
+    @staticmethod
+    def loads(raw):
+        task = orjson.loads(raw)
+        for field in DATE_FIELDS:
+            if task[field] is not None:
+                task[field] = datetime.fromisoformat(task[field])
+        return task
+
+    def collector(self):
+        """ Счетчики кэша как метрики. """
+        def collect():
+            labels = (('backend', self.backend.name), )
+            return [
+                ('task_cache_hits_total', 'counter', [(labels, self.hits)]),
+                ('task_cache_misses_total', 'counter', [(labels, self.misses)]),
+                ('task_cache_evictions_total', 'counter', [(labels, self.backend.evictions)]),
+                ('task_cache_errors_total', 'counter', [(labels, self.errors)]),
+            ]
+        return collect
+
+
+def create_task_cache(backend=TASK_CACHE):
+    """ Кэш задач с хранилищем из настройки TASK_CACHE: memory или redis. """
+    if backend == 'redis':
+        return TaskCache(RedisBackend(TASK_CACHE_URL, ttl=TASK_CACHE_TTL))
+
+    return TaskCache(MemoryBackend(maxsize=TASK_CACHE_SIZE, ttl=TASK_CACHE_TTL))
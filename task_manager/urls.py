@@ -1,9 +1,18 @@
-from .views import GetToken, Register, SingleTaskAPI, TaskAPI, TaskLogs
+from .views import (BatchAPI, GetToken, PoolStats, PrometheusMetrics,
+                    Register, SingleTaskAPI, TaskAPI, TaskBulkAPI,
+                    TaskEventsAPI, TaskLogs, TaskSearchAPI, TaskStatsAPI)
 
 
 def setup_routes(app):
     app.router.add_route('POST', '/get-token', GetToken, name='gen_token')
     app.router.add_route('POST', '/register', Register, name='registration')
     app.router.add_route('GET', '/task/{id}/log', TaskLogs, name='task_log')
+    app.router.add_route('*', '/task/bulk', TaskBulkAPI, name='task_bulk')
+    app.router.add_route('GET', '/task/events', TaskEventsAPI, name='task_events')
+    app.router.add_route('GET', '/task/search', TaskSearchAPI, name='task_search')
+    app.router.add_route('GET', '/task/stats', TaskStatsAPI, name='task_stats')
+    app.router.add_route('POST', '/batch', BatchAPI, name='batch')
     app.router.add_route('*', '/task/{id}', SingleTaskAPI, name='single_task')
     app.router.add_route('*', '/task', TaskAPI, name='task')
+    app.router.add_route('GET', '/pool-stats', PoolStats, name='pool_stats')
+    app.router.add_route('GET', '/metrics', PrometheusMetrics, name='metrics')
@@ -1,50 +1,73 @@
-import hashlib
+import base64
+import zlib
 from datetime import datetime
 
-import jwt
+from .events import notify
+from .models import User
 
-from .models import STATUS_LIST
-from .settings import JWT_SECRET, PASS_SALT
 
+def encode_cursor(created_at, pk):
+    """ Курсор страницы - позиция последней отданной записи (created_at, id). """
+    raw = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
-async def validate_completion_at(completion_at):
-    """ Проверяем что дата завершения введена в нужном формате. """
+
+def decode_cursor(cursor):
+    """ Разбираем курсор обратно в пару (created_at, id).
+        На некорректный курсор выбрасываем ValueError.
+    """
     try:
-        completion_at = datetime.strptime(completion_at, '%d-%m-%Y')
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
     except ValueError:
-        return False
-    else:
-        return completion_at
+        raise ValueError('incorrect cursor')
 
 
-async def validate_status(status):
-    """ Проверка полученного статуса. Статус должен быть одним из списка STATUS_LIST. """
-    status_list = [i[0] for i in STATUS_LIST]
-    if not status in status_list:
-        return False
+def encode_rank_cursor(rank, pk):
+    """ Курсор страницы поиска - позиция последней отданной записи (rank, id). """
+    raw = f'{rank!r}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_rank_cursor(cursor):
+    """ Разбираем курсор поиска обратно в пару (rank, id).
+        На некорректный курсор выбрасываем ValueError.
+    """
+    try:
+        rank, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return float(rank), int(pk)
+    except ValueError:
+        raise ValueError('incorrect cursor')
+
 
-    return True
+def list_etag(user_id, version, query_string):
+    """ ETag списка задач: версия списка пользователя и параметры запроса,
+        у каждой страницы и каждого фильтра свой тег.
+    """
+    return f'W/"{user_id}-{version}-{zlib.crc32(query_string.encode()):x}"'
 
 
-async def serializer(task):
-    """ Формируем словарь для сериализации. """
-    task_dict = {'id': task.id, 'name': task.name,
-                 'description': task.description, 'status': task.status}
-    if task.completion_at:
-        task_dict.update(
-            {"completion_at": task.completion_at.strftime('%d-%m-%Y')})
-    return task_dict
+def task_etag(task_id, version):
+    """ ETag одной задачи. """
+    return f'W/"task-{task_id}-{version}"'
 
 
-async def gen_hash(password: str):
-    """ Хшируем пароль с солью. """
-    str2hash = password + PASS_SALT
-    result = hashlib.md5(str2hash.encode())
-    return result.hexdigest()
+def etag_matches(request, etag):
+    """ Совпадает ли etag с одним из тегов в заголовке If-None-Match. """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+
+    tags = {tag.strip() for tag in header.split(',')}
+    return '*' in tags or etag in tags or etag[2:] in tags
 
 
-async def create_jwt(user):
-    """ Создаем токен, замешивая логин с секретом. """
-    return jwt.encode(
-        {"username": user.login, "scopes": [f"username:{user.login}"]}, JWT_SECRET
-    )
+async def touch_tasks(objects, user_id, event, ids):
+    """ Увеличиваем версию списка задач пользователя, закешированные клиентами
+        страницы списка после этого перестают совпадать по ETag.
+        Тем же запросом отправляем событие event по задачам ids в ленту изменений.
+    """
+    query = (User.update(tasks_version=User.tasks_version + 1)
+             .where(User.id == user_id)
+             .returning(notify(user_id, event, ids)))
+    await objects.execute(query)
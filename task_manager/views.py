@@ -1,217 +1,776 @@
 
+import asyncio
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+import orjson
 import peewee
 from aiohttp import web
+from aiohttp.base_protocol import BaseProtocol
+from aiohttp.streams import StreamReader
+from aiohttp.test_utils import make_mocked_request
 from aiohttp_jwt import login_required
-
-from .models import Task, TaskLog, User
-from .shemes import FilterTask, GetTaskSchema, PutTaskSchema, TaskSchema
-from .utils import (create_jwt, gen_hash, serializer, validate_completion_at,
-                    validate_status)
+from pydantic import ValidationError
+
+from .auth import DUMMY_PASSWORD, needs_rehash
+from .db import after_commit, execute_returning, on_commit, run_pending
+from .encoders import dumps, json_error, json_response
+from .identity import get_user
+from .models import (STATUS_LIST, TASK_FIELDS, Task, TaskCounter, TaskLog,
+                     User, change_log)
+from .queries import TASKS_VERSION, log_page, search_page, task_page
+from .settings import (BATCH_TIMEOUT, BULK_MAX_ITEMS, LOG_STREAM_CHUNK,
+                       MAX_BODY_SIZE, PAGE_SIZE, STATS_ACTIVITY_DAYS,
+                       STATS_DUE_SOON_DAYS, TASK_BODY_MAX_SIZE)
+from .shemes import (BatchSchema, BulkIdsSchema, FieldsSchema, PageLog,
+                     PageTask, PutTaskSchema, SearchTask, TaskSchema)
+from .utils import (encode_cursor, encode_rank_cursor, etag_matches,
+                    list_etag, task_etag, touch_tasks)
+
+
+def check_body_size(size, max_size):
+    """ Тело больше max_size байт - 413 с ошибкой в JSON. """
+    if max_size is not None and size is not None and size > max_size:
+        raise json_error(web.HTTPRequestEntityTooLarge, f'request body is larger than {max_size} bytes',
+                         max_size=max_size, actual_size=size)
+
+
+async def read_body(request, max_size=None):
+    """ Тело запроса целиком. Размер ограничен max_size, а в любом случае
+        client_max_size приложения: его aiohttp проверяет уже при чтении,
+        так что и тело без Content-Length (chunked) больше не прочитаем.
+    """
+    check_body_size(request.content_length, max_size)
+    body = await request.read()
+    check_body_size(len(body), max_size)
+    return body
+
+
+async def read_json(request, max_size=None):
+    """ Тело запроса как JSON-объект, разобранный orjson за один проход, иначе 400.
+        Размер тела ограничен как в read_body.
+    """
+    body = await read_body(request, max_size)
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        raise json_error(web.HTTPBadRequest, 'request body must be a JSON object')
+
+    return data
+
+
+async def read_task(request, schema, user):
+    """ Поля задачи из тела запроса (JSON или форма), проверенные схемой schema.
+        Отдаем пару (введенные значения, проверенная схема),
+        на ошибки проверки - 400 со списком ошибок pydantic.
+    """
+    if request.content_type == 'application/json':
+        body = await read_json(request, TASK_BODY_MAX_SIZE)
+    elif request.content_type == 'multipart/form-data':
+        # multipart разбирается из потока, размер полей проверяем после разбора.
+        check_body_size(request.content_length, TASK_BODY_MAX_SIZE)
+        body = dict(await request.post())
+        check_body_size(sum(len(str(value)) for value in body.values()), TASK_BODY_MAX_SIZE)
+    else:
+        # Форму разбираем из уже прочитанного и проверенного тела.
+        await read_body(request, TASK_BODY_MAX_SIZE)
+        body = dict(await request.post())
+
+    try:
+        return body, schema.parse_obj({**body, 'user': user.id})
+    except ValidationError as e:
+        raise json_error(web.HTTPBadRequest, e.errors())
 
 
 class TaskLogs(web.View):
 
     @login_required
     async def get(self):
-        """ Отдает историю изменений определенной задачи. """
+        """ Отдает историю изменений определенной задачи в порядке (created_at, id).
+            Постранично: размер страницы limit, следующая страница по курсору since.
+            С from_date (%d-%m-%Y) только записи начиная с этой даты, тогда Postgres
+            читает лишь месячные секции tasklog с этой даты. С format=ndjson (или Accept: application/x-ndjson) вся история
+            отдается потоком, по одной записи в строке.
+        """
         self.id = self.request.match_info['id']
         self.app = self.request.app
-        task = await self.get_task()
-        if task is None:
-            return web.json_response({'error': 'task not found'})
+        data = self.request.query
+        try:
+            page = PageLog(limit=data.get('limit', PAGE_SIZE), since=data.get('since'),
+                           from_date=data.get('from_date'))
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        if data.get('format') == 'ndjson' or 'application/x-ndjson' in self.request.headers.get('Accept', ''):
+            if await self.get_task() is None:
+                return json_response({'error': 'task not found'})
+            return await self.stream(self.id, page.since, page.from_date)
+
+        # Сначала читаем историю, наличие задачи проверяем только если история пуста.
+        logs = await self.get_logs(self.id, page.since, page.limit + 1, page.from_date)
+        if not logs and not self.pending_logs() and await self.get_task() is None:
+            return json_response({'error': 'task not found'})
+
+        next_cursor = None
+        if len(logs) > page.limit:
+            logs = logs[:page.limit]
+            next_cursor = encode_cursor(logs[-1]['date'], logs[-1]['id'])
+        else:
+            logs.extend(self.pending_logs())
 
-        logs = await self.app.objects.execute(TaskLog.select().where(TaskLog.task == task))
-        return web.json_response(await self.serializer(logs), status=200)
+        return json_response({'results': logs, 'next_cursor': next_cursor}, status=200)
 
-    @staticmethod
-    async def serializer(logs):
-        """ Формируем словарь для сериализации. """
-        result = []
-        for log in logs:
-            task_log = {'date': str(log.created_at), 'log': log.log}
-            result.append(task_log)
+    async def stream(self, task, since, from_date=None):
+        """ Пишем историю в ответ по мере чтения из БД порциями по LOG_STREAM_CHUNK,
+            поэтому память не зависит от длины истории.
+        """
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(self.request)
+        while True:
+            logs = await self.get_logs(task, since, LOG_STREAM_CHUNK, from_date)
+            if not logs:
+                break
+
+            await response.write(b''.join(dumps(log) + b'\n' for log in logs))
+            since = (logs[-1]['date'], logs[-1]['id'])
+
+        pending = self.pending_logs()
+        if pending:
+            await response.write(b''.join(dumps(log) + b'\n' for log in pending))
+        await response.write_eof()
+        return response
+
+    def pending_logs(self):
+        """ Записи истории, которые воркер еще не записал в БД (отложенная запись).
+            Отдаем их в конце последней страницы, id у них еще нет.
+        """
+        if self.request.app.log_buffer is None:
+            return []
 
-        return result
+        return self.request.app.log_buffer.pending_for(self.id)
+
+    async def get_logs(self, task, since, limit, from_date=None):
+        """ Порция истории после позиции since, см. queries.log_page. """
+        query = log_page(task, since, limit, from_date)
+        return list(await self.app.objects.execute(query.dicts()))
 
     async def get_task(self):
-        """ Пытаемся получить задачу, если такой нет, обрабатываем исключение. """
-        try:
-            task = await self.app.objects.get(Task, id=self.id)
-        except peewee.DoesNotExist:
-            return None
-        else:
-            return task
+        """ Задача из кэша задач, при промахе из БД. None если такой нет. """
+        return await self.app.task_cache.get(self.app.objects, self.id)
 
 
 class SingleTaskAPI(web.View):
 
     @login_required
     async def get(self):
-        """ Отдаем одну задачу по id. """
+        """ Отдаем одну задачу по id (через кэш задач) с ETag по версии задачи.
+            На совпавший If-None-Match отвечаем 304 без сериализации.
+            Параметр fields (через запятую) оставляет в ответе только эти поля.
+        """
         self.id = self.request.match_info['id']
         self.app = self.request.app
-        task = await self.get_task()
+        try:
+            fields = FieldsSchema(fields=self.request.query.get('fields')).field_names
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        task = await self.app.task_cache.get(self.app.objects, self.id)
         if task is None:
-            return web.json_response({'error': 'task not found'})
+            return json_response({'error': 'task not found'})
 
-        data = TaskSchema(**task.__dict__['__data__'])
-        return web.json_response(text=data.json(), status=200)
+        etag = task_etag(task['id'], task.pop('version'))
+        if etag_matches(self.request, etag):
+            return web.Response(status=304, headers={'ETag': etag})
+
+        if fields:
+            task = {key: task[key] for key in fields}
+        return json_response(task, status=200, headers={'ETag': etag})
 
     @login_required
     async def put(self):
-        """ Изменить задачу по id. """
+        """ Изменить задачу по id.
+            Задача читается из БД с блокировкой строки, изменение и запись
+            истории выполняются в той же транзакции. Кэш задач для записи
+            не используется: в другом воркере он может быть устаревшим.
+        """
         self.id = self.request.match_info['id']
         self.app = self.request.app
-        task = await self.get_task()
-        if task is None:
-            return web.json_response({'error': 'task not found'}, status=400)
-
         user = await self.get_user()
-        if user.id != task.user_id:
-            return web.json_response({'error': 'Access is denied'}, status=403)
-
-        data = await self.request.post()
-        self.name = data.get('name')
-        self.description = data.get('description')
-        self.status = data.get('status')
-        self.completion_at = data.get('completion_at')
-
-        data = PutTaskSchema(
-            user=user.id,
-            name=self.name, 
-            description=self.description,
-            status=self.status,
-            completion_at=self.completion_at,
-        )
-        
-        await self.update_fields(task)
-        updeted_task = await self.get_task()
-        return web.json_response(data.json(), status=200)
+        body, data = await read_task(self.request, PutTaskSchema, user)
+        async with self.app.objects.atomic():
+            task = await self.get_task()
+            if task is None:
+                return json_response({'error': 'task not found'}, status=400)
+            if user.id != task.user_id:
+                return json_response({'error': 'Access is denied'}, status=403)
+
+            task = await self.update_fields(task, body, data)
+            if task is None:
+                return json_response({'error': 'task not found'}, status=400)
+        await on_commit(self.app.task_cache.invalidate, task.id, rollback=True)
+        if self.logs and self.app.log_buffer is not None:
+            await on_commit(self.app.log_buffer.put, self.logs)
+
+        data = dict(task.__data__)
+        etag = task_etag(task.id, data.pop('version'))
+        return json_response(data, status=200, headers={'ETag': etag})
 
     @login_required
     async def delete(self):
-        """ Удаляем задачу по id. """
+        """ Удаляем задачу по id, задачу читаем из БД с блокировкой строки. """
         self.id = self.request.match_info['id']
         self.app = self.request.app
-        task = await self.get_task()
-        if task is None:
-            return web.json_response({'error': 'task not found'}, status=400)
         user = await self.get_user()
-        if user.id != task.user_id:
-            return web.json_response({'error': 'Access is denied'}, status=403)
-
-        await self.app.objects.delete(task)
+        async with self.app.objects.atomic():
+            task = await self.get_task()
+            if task is None:
+                return json_response({'error': 'task not found'}, status=400)
+            if user.id != task.user_id:
+                return json_response({'error': 'Access is denied'}, status=403)
+
+            await self.app.objects.delete(task)
+            await touch_tasks(self.app.objects, user.id, 'deleted', [task.id])
+        await on_commit(self.app.task_cache.invalidate, task.id, rollback=True)
         self.app.logger.debug(f'Удалена задача {task.name}')
-        return web.json_response({'status': 'deleted'}, status=204)
+        return json_response({'status': 'deleted'}, status=204)
 
-    async def update_fields(self, task):
+    async def update_fields(self, task, body, data):
         """ Метод обновляет те свойства, которые изменились.
-            Формируем словарь feilds всех свойств и их значений.
-            Обходим все элементы словаря и обновляем те свойства, которые поменялись.
-            Записывает в TaskLog историю изменений.
+            Формируем словарь feilds всех свойств: (введенное значение из body, проверенное значение).
+            Все поменявшиеся свойства обновляем одним UPDATE ... RETURNING,
+            историю изменений записываем в TaskLog одним insert_many
+            (с отложенной записью история остается в self.logs и ставится
+            в очередь после коммита), версии задачи и списка задач увеличиваем.
+            Возвращаем обновленную задачу, None если задачи уже нет.
         """
-        feilds = {
-            'name': self.name,
-            'description': self.description,
-            'status': self.status,
-            'completion_at': self.completion_at
-        }
-        for key, value in feilds.items():
-            if value and value != str(getattr(task, key)):
-                await self.app.objects.execute(Task.update(**{key: value}).where(Task.id == self.id))
-                await self.app.objects.create(
-                    TaskLog,
-                    task=task,
-                    log=f'Значение поля {key} изменено на {value}',
-                )
-                self.app.logger.debug(f'У задачи {task.name} изменено значение поля {key} на {value}')
+        feilds = {key: (body.get(key), getattr(data, key))
+                  for key in ('name', 'description', 'status', 'completion_at')}
+        changed = {}
+        self.logs = []
+        for key, (raw, value) in feilds.items():
+            if raw and value != getattr(task, key):
+                changed[key] = value
+                self.logs.append(change_log(task.id, key, raw))
+
+        if not changed:
+            return task
+
+        query = (Task.update(**changed, version=Task.version + 1)
+                 .where(Task.id == task.id).returning(Task))
+        updated = list(await self.app.objects.execute(query))
+        if not updated:
+            return None
+
+        updated_task = updated[0]
+        if self.app.log_buffer is None:
+            await self.app.objects.execute(TaskLog.insert_many(self.logs))
+        await touch_tasks(self.app.objects, task.user_id, 'updated', [task.id])
+        self.app.logger.debug(f'У задачи {task.name} изменены поля {", ".join(changed)}')
+        return updated_task
 
     async def get_task(self):
+        """ Задача из БД с блокировкой строки (SELECT ... FOR UPDATE) до конца
+            транзакции. None если такой нет.
+        """
         try:
-            task = await self.app.objects.get(Task.select().join(User).where(Task.id == self.id))
+            task_id = int(self.id)
+        except ValueError:
+            return None
+
+        query = Task.select(*TASK_FIELDS, Task.version).where(Task.id == task_id).for_update()
+        try:
+            return await self.app.objects.get(query)
         except peewee.DoesNotExist:
             return None
-        else:
-            return task
 
     async def get_user(self):
-        """ Получаем логин пользователя из словаря request
-            Возвращаем объект User с данным логином.
-        """
-        username = self.request["user"].get("username")
-        return await self.app.objects.get(User, login=username)
+        """ Пользователь из токена, без запроса в БД если он есть в кэше. """
+        return await get_user(self.request)
 
 
 class TaskAPI(web.View):
 
     @login_required
     async def get(self):
-        """ Выводим все задачи пользователя. 
-            Если в запросе есть параметры status,completion_at, 
-            фильтруем задачи по ним.
+        """ Выводим задачи пользователя постранично, в порядке (created_at, id).
+            Если в запросе есть параметры status,completion_at,q,
+            фильтруем задачи по ним (q - полнотекстовый поиск). Размер страницы задает limit,
+            следующую страницу отдаем по курсору after из next_cursor.
+            Параметр fields (через запятую) сужает и SELECT, и ответ,
+            для курсора дополнительно читаем id и created_at.
+            ETag строится из версии списка задач пользователя и параметров запроса,
+            на совпавший If-None-Match отвечаем 304 без запроса задач.
         """
         self.app = self.request.app
         data = self.request.query
-        status = data.get('status')
-        completion_at = data.get('completion_at')
+        try:
+            data = PageTask(
+                status=data.get('status'),
+                completion_at=data.get('completion_at'),
+                limit=data.get('limit', PAGE_SIZE),
+                after=data.get('after'),
+                fields=data.get('fields'),
+                q=data.get('q'),
+            )
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
 
         user = await self.get_user()
-        tasks = status_query = completion_at_query = Task.select().where(Task.user == user)
+        rows = await self.app.objects.prepared(TASKS_VERSION, user=user.id)
+        version = rows[0]['tasks_version'] if rows else None
+        etag = list_etag(user.id, version, self.request.query_string)
+        if etag_matches(self.request, etag):
+            return web.Response(status=304, headers={'ETag': etag})
+
+        # Шаблон запроса для этого сочетания полей и фильтров, см. queries.task_page.
+        statement = task_page(tuple(sorted(data.field_names)) if data.field_names else None,
+                              bool(data.status), bool(data.completion_at), bool(data.q), bool(data.after))
+        after_created_at, after_id = data.after or (None, None)
+        # Берем на одну запись больше, чтобы узнать есть ли следующая страница.
+        tasks = await self.app.objects.prepared(
+            statement, user=user.id, status=data.status, completion_at=data.completion_at, q=data.q,
+            after_created_at=after_created_at, after_id=after_id, limit=data.limit + 1)
+
+        next_cursor = None
+        if len(tasks) > data.limit:
+            tasks = tasks[:data.limit]
+            next_cursor = encode_cursor(tasks[-1]['created_at'], tasks[-1]['id'])
+
+        if data.field_names:
+            tasks = [{key: task[key] for key in data.field_names} for task in tasks]
+        return json_response({'results': tasks, 'next_cursor': next_cursor}, status=200,
+                             headers={'ETag': etag})
 
-        data = FilterTask(
-            status=status,
-            completion_at=completion_at,
-        )
-        if status:
-            status_query = Task.select().where(Task.status == status, Task.user == user)
+    @login_required
+    async def post(self):
+        """ Создание задачи. Тело запроса - JSON или форма,
+            проверяется один раз схемой TaskSchema.
+        """
+        self.app = self.request.app
+        user = await self.get_user()
+        _, data = await read_task(self.request, TaskSchema, user)
+        async with self.app.objects.atomic():
+            new_task = await self.app.objects.create(
+                Task,
+                **data.dict()
+            )
+            await touch_tasks(self.app.objects, user.id, 'created', [new_task.id])
+        
+        self.app.logger.debug(f'Создана задача {new_task}.')
+        return json_response(new_task.__data__, status=201)
 
-        if completion_at:
-            completion_at_query = Task.select().where(
-                Task.completion_at >= data['completion_at'], Task.user == user)
+    async def get_user(self):
+        """ Пользователь из токена, без запроса в БД если он есть в кэше. """
+        return await get_user(self.request)
 
-        query = tasks & status_query & completion_at_query
-        tasks = await self.app.objects.execute(query)
 
-        result_list = []
-        for task in tasks:
-            obj = GetTaskSchema(**task.__dict__['__data__'])
-            result_list.append(obj.json())
+class TaskSearchAPI(web.View):
 
-        return web.json_response(result_list, status=200)
+    @login_required
+    async def get(self):
+        """ Полнотекстовый поиск q по названию и описанию задач пользователя.
+            Фильтры status, completion_at и fields как у списка задач.
+            Результаты по убыванию релевантности rank, следующая страница
+            по курсору after из next_cursor.
+        """
+        self.app = self.request.app
+        data = self.request.query
+        try:
+            data = SearchTask(
+                q=data.get('q'),
+                status=data.get('status'),
+                completion_at=data.get('completion_at'),
+                limit=data.get('limit', PAGE_SIZE),
+                after=data.get('after'),
+                fields=data.get('fields'),
+            )
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        user = await get_user(self.request)
+        query = search_page(user.id, data, data.limit + 1)
+        tasks = list(await self.app.objects.execute(query.dicts()))
+
+        next_cursor = None
+        if len(tasks) > data.limit:
+            tasks = tasks[:data.limit]
+            next_cursor = encode_rank_cursor(tasks[-1]['rank'], tasks[-1]['id'])
+
+        if data.field_names:
+            tasks = [{'rank': task['rank'], **{key: task[key] for key in data.field_names}} for task in tasks]
+        return json_response({'results': tasks, 'next_cursor': next_cursor}, status=200)
+
+
+class TaskStatsAPI(web.View):
+
+    @login_required
+    async def get(self):
+        """ Сводка по задачам пользователя: число задач по статусам,
+            просроченные (completion_at раньше сегодня, задача не завершена),
+            со сроком в ближайшие STATS_DUE_SOON_DAYS дней и число записей
+            истории по дням за STATS_ACTIVITY_DAYS дней.
+            Читаем только счетчики taskcounter одним запросом по первичному ключу,
+            поэтому стоимость не зависит от числа задач: прошедшие сроки
+            свернуты в один счетчик overdue (counters.rollup), ключи due:
+            в прошлом остаются только с момента последней свертки.
+        """
+        app = self.request.app
+        user = await get_user(self.request)
+        today = date.today()
+        soon = today + timedelta(days=STATS_DUE_SOON_DAYS)
+        since = today - timedelta(days=STATS_ACTIVITY_DAYS - 1)
+        key = TaskCounter.key
+        query = TaskCounter.select(key, TaskCounter.value).where(
+            TaskCounter.user == user.id,
+            ((key > 'status:') & (key < 'status;'))
+            | (key == 'overdue')
+            | ((key > 'due:') & (key <= f'due:{soon}'))
+            | ((key >= f'log:{since}') & (key < 'log;')))
+
+        statuses = {status: 0 for status, _ in STATUS_LIST}
+        overdue = due_soon = 0
+        activity = {str(since + timedelta(days=i)): 0 for i in range(STATS_ACTIVITY_DAYS)}
+        for counter, value in await app.objects.execute(query.tuples()):
+            kind, _, name = counter.partition(':')
+            if kind == 'status':
+                statuses[name] = value
+            elif kind == 'overdue' or (kind == 'due' and name < str(today)):
+                overdue += value
+            elif kind == 'due':
+                due_soon += value
+            else:
+                activity[name] = value
+
+        return json_response({
+            'total': sum(statuses.values()),
+            'status': statuses,
+            'overdue': overdue,
+            'due_soon': due_soon,
+            'activity': activity,
+        }, status=200)
+
+
+class TaskBulkAPI(web.View):
+    """ Массовые операции над задачами пользователя. Тело запроса - JSON.
+        В ответе результат по каждому элементу в порядке запроса.
+    """
 
     @login_required
     async def post(self):
-        """ Создание задачи. Валидация данных. """
+        """ Создание нескольких задач одним insert_many.
+            {"tasks": [{"name": ..., "description": ..., "status": ..., "completion_at": ...}, ...]}
+        """
         self.app = self.request.app
-        data = await self.request.post()
-        name = data.get('name')
-        description = data.get('description')
-        status = data.get('status')
-        completion_at = data.get('completion_at')
+        data = await read_json(self.request)
+        items = data.get('tasks')
+        if not isinstance(items, list) or not 0 < len(items) <= BULK_MAX_ITEMS:
+            return json_response({'error': f'tasks must be a list of 1..{BULK_MAX_ITEMS} items'}, status=400)
 
         user = await self.get_user()
-        data = TaskSchema(
-            user=user.id,
-            name=name, 
-            description=description,
-            status=status,
-            completion_at=completion_at,
-        )
-        
-        new_task = await self.app.objects.create(
-            Task,
-            **data.dict()
-        )
-        
-        self.app.logger.debug(f'Создана задача {new_task}.')
-        return web.json_response(data.json(), status=201)
+        results = []
+        rows = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({'index': index, 'error': 'item must be an object'})
+                continue
+
+            try:
+                task = TaskSchema.parse_obj({**item, 'user': user.id})
+            except ValidationError as e:
+                results.append({'index': index, 'error': e.errors()})
+            else:
+                results.append({'index': index})
+                rows.append(task.dict())
+
+        if rows:
+            async with self.app.objects.atomic():
+                created = await execute_returning(self.app.objects, Task.insert_many(rows).returning(Task.id))
+                await touch_tasks(self.app.objects, user.id, 'created', [row['id'] for row in created])
+            created_ids = iter(row['id'] for row in created)
+            for result in results:
+                if 'error' not in result:
+                    result.update({'id': next(created_ids), 'status': 'created'})
+            self.app.logger.debug(f'Создано задач: {len(rows)}')
+
+        return json_response({'results': results}, status=201 if rows else 400)
+
+    @login_required
+    async def put(self):
+        """ Изменение status и/или completion_at у списка задач.
+            {"ids": [...], "status": ..., "completion_at": ...}
+            Один UPDATE по задачам пользователя и один insert_many в историю.
+        """
+        self.app = self.request.app
+        data = await read_json(self.request)
+        try:
+            ids = BulkIdsSchema(ids=data.get('ids')).ids
+            values = PutTaskSchema(status=data.get('status'), completion_at=data.get('completion_at'))
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        fields = {
+            'status': (data.get('status'), values.status),
+            'completion_at': (data.get('completion_at'), values.completion_at),
+        }
+        fields = {key: value for key, value in fields.items() if value[0]}
+        if not fields:
+            return json_response({'error': 'nothing to update, pass status or completion_at'}, status=400)
+
+        user = await self.get_user()
+        async with self.app.objects.atomic():
+            query = (Task.select(Task.id, Task.status, Task.completion_at)
+                     .where(Task.id.in_(ids), Task.user == user.id)
+                     .for_update())
+            tasks = {task.id: task for task in await self.app.objects.execute(query)}
+
+            changed_ids = []
+            logs = []
+            for task in tasks.values():
+                changed = [key for key, (_, value) in fields.items() if value != getattr(task, key)]
+                if changed:
+                    changed_ids.append(task.id)
+                for key in changed:
+                    logs.append(change_log(task.id, key, fields[key][0]))
+
+            if changed_ids:
+                update = {key: value for key, (_, value) in fields.items()}
+                update['version'] = Task.version + 1
+                await self.app.objects.execute(Task.update(**update).where(Task.id.in_(changed_ids)))
+                if self.app.log_buffer is None:
+                    await self.app.objects.execute(TaskLog.insert_many(logs))
+                await touch_tasks(self.app.objects, user.id, 'updated', changed_ids)
+        await on_commit(self.app.task_cache.invalidate, *changed_ids, rollback=True)
+        if logs and self.app.log_buffer is not None:
+            await on_commit(self.app.log_buffer.put, logs)
+
+        changed_ids = set(changed_ids)
+        results = []
+        for task_id in ids:
+            if task_id not in tasks:
+                results.append({'id': task_id, 'error': 'task not found'})
+            else:
+                results.append({'id': task_id, 'status': 'updated' if task_id in changed_ids else 'unchanged'})
+
+        return json_response({'results': results}, status=200)
+
+    @login_required
+    async def delete(self):
+        """ Удаление списка задач пользователя одним DELETE. {"ids": [...]} """
+        self.app = self.request.app
+        data = await read_json(self.request)
+        try:
+            ids = BulkIdsSchema(ids=data.get('ids')).ids
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        user = await self.get_user()
+        query = Task.delete().where(Task.id.in_(ids), Task.user == user.id).returning(Task.id)
+        async with self.app.objects.atomic():
+            deleted = {row['id'] for row in await execute_returning(self.app.objects, query)}
+            if deleted:
+                await touch_tasks(self.app.objects, user.id, 'deleted', deleted)
+        await on_commit(self.app.task_cache.invalidate, *deleted, rollback=True)
+        self.app.logger.debug(f'Удалено задач: {len(deleted)}')
+
+        results = []
+        for task_id in ids:
+            if task_id in deleted:
+                results.append({'id': task_id, 'status': 'deleted'})
+            else:
+                results.append({'id': task_id, 'error': 'task not found'})
+
+        return json_response({'results': results}, status=200)
 
     async def get_user(self):
-        """ Получаем логин пользователя из словаря request
-            Возвращаем объект User с данным логином.
+        """ Пользователь из токена, без запроса в БД если он есть в кэше. """
+        return await get_user(self.request)
+
+
+class TaskEventsAPI(web.View):
+
+    @login_required
+    async def get(self):
+        """ Лента изменений задач пользователя в формате Server-Sent Events:
+            event: created|updated|deleted, data: {"event": ..., "ids": [...]},
+            для больших пачек вместо списка {"ids": null, "count": n}.
+            После подписки отдаем event: ready, пока событий нет - комментарий
+            heartbeat. Не успевающий читать клиент получает event: overflow
+            и отключается, после переподключения ему стоит перечитать список.
         """
-        username = self.request["user"].get("username")
-        return await self.app.objects.get(User, login=username)
+        events = self.request.app.task_events
+        user = await get_user(self.request)
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(self.request)
+        with events.subscribe(user.id) as queue:
+            try:
+                await asyncio.wait_for(asyncio.shield(events.ready.wait()), events.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+            await response.write(b'retry: 3000\nevent: ready\ndata: {}\n\n')
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), events.heartbeat)
+                except asyncio.TimeoutError:
+                    await response.write(b': heartbeat\n\n')
+                    continue
+
+                if event is None:
+                    await response.write(b'event: overflow\ndata: {}\n\n')
+                    break
+                await response.write(b'event: %s\ndata: %s\n\n' % (event['event'].encode(), dumps(event)))
+
+        return response
+
+
+# Маршруты, которые можно вызывать из /batch: ответы только целиком, без потоковых.
+BATCH_ROUTES = {'task', 'single_task', 'task_log', 'task_bulk', 'task_search', 'task_stats'}
+
+
+class BatchRollback(Exception):
+    """ Откатываем неуспешную операцию /batch, с atomic - всю транзакцию. """
+
+
+def not_applied(results):
+    """ Результаты операций откатившейся транзакции /batch. """
+    return [dict(result, applied=False) for result in results]
+
+
+class BatchAPI(web.View):
+
+    @login_required
+    async def post(self):
+        """ Несколько операций с задачами одним запросом:
+            {"atomic": false, "operations": [{"method": "PUT", "path": "/task/1", "data": {...}}]}.
+            Операции по очереди выполняются обработчиками приложения без
+            HTTP-обвязки, пользователь из токена ищется один раз на весь batch.
+            Тело операции передается в data (форма) или json. Весь batch идет
+            в одной транзакции на одном соединении пула. Без atomic каждая
+            операция выполняется в своей точке сохранения, и ответ с кодом
+            >= 400 откатывает только ее. С atomic все операции откатываются
+            после первого ответа с кодом >= 400.
+            Отдаем статус и тело ответа каждой выполненной операции, если
+            транзакция откатилась (atomic или таймаут) - с "applied": false.
+        """
+        self.app = self.request.app
+        await get_user(self.request)
+        try:
+            data = BatchSchema(**await read_json(self.request))
+        except ValidationError as e:
+            return json_response({'error': e.errors()}, status=400)
+
+        results = []
+        try:
+            committed = await asyncio.wait_for(self.run(data, results), BATCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            return json_response({'error': 'batch timeout', 'results': not_applied(results)}, status=504)
+
+        if not committed:
+            return json_response({'error': 'batch rolled back', 'results': not_applied(results)}, status=400)
+
+        return json_response({'results': results}, status=200)
+
+    async def run(self, data, results):
+        """ Выполняем операции в общей транзакции.
+            Сброс кэша и буфер истории откладываются до ее завершения.
+        """
+        pending = []
+        token = after_commit.set(pending)
+        committed = False
+        try:
+            async with self.app.objects.atomic():
+                for operation in data.operations:
+                    if not data.atomic:
+                        results.append(await self.savepoint(operation, pending))
+                        continue
+
+                    result = await self.call(operation)
+                    results.append(result)
+                    if result['status'] >= 400:
+                        raise BatchRollback
+            committed = True
+        except BatchRollback:
+            pass
+        finally:
+            after_commit.reset(token)
+            await run_pending(pending, committed)
+
+        return committed
+
+    async def savepoint(self, operation, pending):
+        """ Операция в точке сохранения. При ответе >= 400 откатываем только ее,
+            из ее отложенных действий остаются те, что нужны и после отката.
+        """
+        operation_pending = []
+        token = after_commit.set(operation_pending)
+        try:
+            async with self.app.objects.atomic():
+                result = await self.call(operation)
+                if result['status'] >= 400:
+                    raise BatchRollback
+        except BatchRollback:
+            operation_pending = [action for action in operation_pending if action[2]]
+        finally:
+            after_commit.reset(token)
+
+        pending.extend(operation_pending)
+        return result
+
+    async def call(self, operation):
+        """ Выполняем одну операцию обработчиком ее маршрута. """
+        headers = {'Authorization': self.request.headers.get('Authorization', '')}
+        body = b''
+        if operation.json_body is not None:
+            body = orjson.dumps(operation.json_body)
+            headers['Content-Type'] = 'application/json'
+        elif operation.data is not None:
+            body = urlencode(operation.data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        headers['Content-Length'] = str(len(body))
+
+        request = self.sub_request(operation, headers, body)
+        match_info = await self.app.router.resolve(request)
+        if match_info.http_exception is not None:
+            return {'status': match_info.http_exception.status, 'body': {'error': 'route not found'}}
+        if match_info.route.name not in BATCH_ROUTES or request.query.get('format') == 'ndjson':
+            return {'status': 400, 'body': {'error': 'operation is not allowed in batch'}}
+
+        request.match_info.update(match_info)
+        try:
+            response = await match_info.handler(request)
+        except web.HTTPException as e:
+            response = e
+        except Exception:
+            # Ошибка одной операции не обрывает весь batch.
+            self.app.logger.exception(f'Операция batch {operation.method} {operation.path} упала')
+            return {'status': 500, 'body': {'error': 'internal error'}}
+
+        body = response.body
+        if body and response.content_type == 'application/json':
+            body = orjson.loads(body)
+        elif body:
+            body = body.decode()
+        return {'status': response.status, 'body': body}
+
+    def sub_request(self, operation, headers, body):
+        """ Запрос операции: тело отдается из готового потока, а не из
+            соединения, состояние (токен, пользователь) берем из запроса /batch.
+        """
+        loop = asyncio.get_event_loop()
+        payload = StreamReader(BaseProtocol(loop), limit=max(len(body), 2 ** 16), loop=loop)
+        payload.feed_data(body, len(body))
+        payload.feed_eof()
+        request = make_mocked_request(operation.method, operation.path, headers, app=self.app,
+                                      payload=payload, client_max_size=MAX_BODY_SIZE, loop=loop)
+        for key, value in self.request.items():
+            request[key] = value
+        return request
 
 
 class GetToken(web.View):
@@ -222,24 +781,33 @@ class GetToken(web.View):
         self.login = data.get('login')
         self.password = data.get('password')
         if self.login is None or self.password is None:
-            return web.json_response({'auth_error': 'incorrect data'}, status=400)
+            return json_response({'auth_error': 'incorrect data'}, status=400)
         user = await self.check_user()
         if user:
-            token = await create_jwt(user)
+            token = await self.app.auth.create_jwt(user)
             self.app.logger.debug(f'Пользователь {user.login} запросил токен.')
-            return web.json_response({'access_token': token.decode()}, status=200)
+            return json_response({'access_token': token.decode()}, status=200)
         else:
-            return web.json_response({'auth_error': 'incorrect data'}, status=400)
+            return json_response({'auth_error': 'incorrect data'}, status=400)
 
     async def check_user(self):
-        """ Проверяем существует ли пользователь с указанными данными. """
-        pass_hash = await gen_hash(self.password)
+        """ Проверяем существует ли пользователь с указанными данными.
+            Пароли в старом формате (md5) при успешном входе перехешируем.
+            Для неизвестного логина пароль все равно проверяется, с DUMMY_PASSWORD.
+        """
         try:
-            user = await self.app.objects.get(User, login=self.login, password=pass_hash)
+            user = await self.app.objects.get(User, login=self.login)
         except peewee.DoesNotExist:
+            await self.app.auth.check_password(self.password, DUMMY_PASSWORD)
             return False
-        else:
-            return user
+
+        if not await self.app.auth.check_password(self.password, user.password):
+            return False
+
+        if needs_rehash(user.password):
+            user.password = await self.app.auth.make_password(self.password)
+            await self.app.objects.update(user, only=['password'])
+        return user
 
 
 class Register(web.View):
@@ -253,17 +821,17 @@ class Register(web.View):
         self.password = data.get('password')
         error = await self.validate_login_and_password()
         if error:
-            return web.json_response({'error': error}, status=400)
+            return json_response({'error': error}, status=400)
 
-        pass_hash = await gen_hash(self.password)
+        pass_hash = await app.auth.make_password(self.password)
         try:
             new_user = await app.objects.create(User, login=self.login, password=pass_hash)
         except peewee.IntegrityError:
-            return web.json_response({'error': 'login alrede exists'}, status=400)
+            return json_response({'error': 'login alrede exists'}, status=400)
         else:
             app.logger.debug(f'Зарегистрирован новый пользователь {new_user}')
-            token = await create_jwt(new_user)
-            return web.json_response({'access_token': token.decode()}, status=200)
+            token = await app.auth.create_jwt(new_user)
+            return json_response({'access_token': token.decode()}, status=200)
 
     async def validate_login_and_password(self):
         """ Простейшая валидация логина и пароля. """
@@ -272,3 +840,16 @@ class Register(web.View):
             error = 'incorrect data'
 
         return error
+
+
+class PoolStats(web.View):
+    async def get(self):
+        """ Текущее состояние пула соединений воркера. """
+        return json_response(self.request.app.database.pool_stats(), status=200)
+
+
+class PrometheusMetrics(web.View):
+    async def get(self):
+        """ Метрики воркера в текстовом формате Prometheus. """
+        return web.Response(text=self.request.app.metrics.render(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import contextmanager
+
 import jwt
 import peewee
 import peewee_async
@@ -39,8 +42,80 @@ async def user(app):
     await app.objects.delete(user)
 
 
+@pytest.fixture
+def user_token(user):
+    """ Токен с user_id, как его выдает приложение. """
+    return jwt.encode(
+        {"username": user.login, "user_id": user.id, "scopes": [f"username:{user.login}"]}, JWT_SECRET
+    ).decode()
+
+
 @pytest.fixture
 async def task(app, user):
     task = await app.objects.create(Task, user=user, name='Teting task', description='description', status='new')
     yield task
     await app.objects.delete(task)
+
+
+@pytest.fixture
+def max_queries(app):
+    """ Проверяем, что внутри блока через app.objects прошло не больше limit запросов:
+        with max_queries(2):
+            await client.get(...)
+    """
+    @contextmanager
+    def check(limit):
+        queries = []
+        hook = lambda query, elapsed: queries.append(query.sql()[0])
+        app.objects.query_hooks.append(hook)
+        try:
+            yield queries
+        finally:
+            app.objects.query_hooks.remove(hook)
+        assert len(queries) <= limit, f'{len(queries)} запросов вместо {limit}: {queries}'
+
+    return check
+
+
+@pytest.fixture
+async def redis_stub():
+    """ Заглушка Redis для проверки RedisBackend: понимает GET, SET (с NX), DEL и SELECT,
+        время жизни ключей не учитывает. Отдает url сервера.
+    """
+    storage = {}
+
+    async def read_command(reader):
+        count = int((await reader.readline())[1:])
+        args = []
+        for _ in range(count):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                command, *args = await read_command(reader)
+                command = command.upper()
+                if command == b'GET':
+                    value = storage.get(args[0])
+                    writer.write(b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value))
+                elif command == b'SET':
+                    if b'NX' in args[2:] and args[0] in storage:
+                        writer.write(b'$-1\r\n')
+                        continue
+                    storage[args[0]] = args[1]
+                    writer.write(b'+OK\r\n')
+                elif command == b'DEL':
+                    deleted = sum(storage.pop(key, None) is not None for key in args)
+                    writer.write(b':%d\r\n' % deleted)
+                else:
+                    writer.write(b'+OK\r\n')
+        except (asyncio.IncompleteReadError, ValueError):
+            writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    yield f'redis://{host}:{port}/1'
+    server.close()
+    await server.wait_closed()
@@ -1,4 +1,26 @@
-from task_manager.models import STATUS_LIST, Task, TaskLog, User
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import jwt
+import peewee
+import pytest
+from task_manager.auth import (DUMMY_PASSWORD, check_password, legacy_hash,
+                               needs_rehash)
+from task_manager.cache import RedisBackend
+from task_manager.counters import rebuild, rollup
+from task_manager.events import notify
+from task_manager.identity import identity_cache
+from task_manager.log_buffer import LogBuffer
+from task_manager.models import (STATUS_LIST, Task, TaskCounter, TaskLog, User,
+                                 database)
+from task_manager.partitions import (DEFAULT, create_partition,
+                                     expired_partitions, is_partitioned,
+                                     partition_name, partitions)
+from task_manager.queries import TASK_BY_ID, task_page
+from task_manager.settings import DATABASE, JWT_SECRET
+from task_manager.task_cache import TaskCache
 
 
 async def test_registration_without(client):
@@ -12,7 +34,9 @@ async def test_registration(client, token):
     # Можем зарегистрироваься если указали логин и пароль.
     resp = await client.post(client.app.router['registration'].url_for(), data={'login': 'ivan', 'password': '123456'})
     assert resp.status == 200
-    assert token in await resp.text()
+    claims = jwt.decode((await resp.json())['access_token'], JWT_SECRET)
+    assert claims['username'] == 'ivan'
+    assert 'user_id' in claims
 
 
 async def test_get_token_without(client):
@@ -27,7 +51,24 @@ async def test_get_token(client, token):
     await client.post(client.app.router['registration'].url_for(), data={'login': 'ivan', 'password': '123456'})
     resp = await client.post(client.app.router['gen_token'].url_for(), data={'login': 'ivan', 'password': '123456'})
     assert resp.status == 200
-    assert token in await resp.text()
+    claims = jwt.decode((await resp.json())['access_token'], JWT_SECRET)
+    assert claims['username'] == 'ivan'
+    assert 'user_id' in claims
+
+
+async def test_get_token_unknown_login(client, monkeypatch):
+    # Для неизвестного логина пароль тоже проверяется, с хешем-заглушкой.
+    checked = []
+    check = client.app.auth.check_password
+
+    async def check_password(password, encoded):
+        checked.append(encoded)
+        return await check(password, encoded)
+
+    monkeypatch.setattr(client.app.auth, 'check_password', check_password)
+    resp = await client.post(client.app.router['gen_token'].url_for(), data={'login': 'nobody', 'password': '123456'})
+    assert resp.status == 400
+    assert checked == [DUMMY_PASSWORD]
 
 
 async def test_create_task_without(client):
@@ -71,4 +112,609 @@ async def test_get_history(client, token, task):
     assert resp.status == 200
     assert 'Changed description' in await resp.text()
     assert '11-11-2020' in await resp.text()
-    assert len(await resp.json()) == 2
+    assert len((await resp.json())['results']) == 2
+
+
+async def test_get_tasks_page(client, token, user):
+    # Список задач отдается постранично, следующую страницу получаем по курсору.
+    for i in range(3):
+        await client.app.objects.create(Task, user=user, name=f'Task {i}', description='description', status='new')
+
+    resp = await client.get(client.app.router['task'].url_for().with_query(limit=2),
+                            headers={"Authorization": f"Bearer {token}"})
+    assert resp.status == 200
+    page = await resp.json()
+    assert len(page['results']) == 2
+    assert page['results'][0]['name'] == 'Task 0'
+    assert page['next_cursor'] is not None
+
+    resp = await client.get(client.app.router['task'].url_for().with_query(limit=2, after=page['next_cursor']),
+                            headers={"Authorization": f"Bearer {token}"})
+    page = await resp.json()
+    assert len(page['results']) == 1
+    assert page['next_cursor'] is None
+
+
+async def test_etag(client, token, task):
+    # Неизмененные список и задача отдаются как 304, после изменения снова 200.
+    headers = {"Authorization": f"Bearer {token}"}
+    list_url = client.app.router['task'].url_for()
+    task_url = client.app.router['single_task'].url_for(id=str(task.id))
+    resp = await client.get(list_url, headers=headers)
+    list_etag = resp.headers['ETag']
+    resp = await client.get(task_url, headers=headers)
+    task_etag = resp.headers['ETag']
+
+    resp = await client.get(list_url, headers={**headers, 'If-None-Match': list_etag})
+    assert resp.status == 304
+    resp = await client.get(list_url.with_query(status='new'), headers={**headers, 'If-None-Match': list_etag})
+    assert resp.status == 200
+    resp = await client.get(task_url, headers={**headers, 'If-None-Match': task_etag})
+    assert resp.status == 304
+
+    put = await client.put(task_url, data={'status': 'planned'}, headers=headers)
+    assert 'version' not in await put.json()
+    resp = await client.get(list_url, headers={**headers, 'If-None-Match': list_etag})
+    assert resp.status == 200
+    resp = await client.get(task_url, headers={**headers, 'If-None-Match': task_etag})
+    assert resp.status == 200
+    assert resp.headers['ETag'] != task_etag
+    assert resp.headers['ETag'] == put.headers['ETag']
+
+
+async def test_sparse_fields(client, token, task):
+    # Параметр fields оставляет в ответе только перечисленные поля.
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = await client.get(client.app.router['task'].url_for().with_query(fields='name,status'), headers=headers)
+    page = await resp.json()
+    assert page['results'] == [{'name': task.name, 'status': 'new'}]
+
+    resp = await client.get(client.app.router['single_task'].url_for(id=str(task.id)).with_query(fields='id'),
+                            headers=headers)
+    assert await resp.json() == {'id': task.id}
+
+    resp = await client.get(client.app.router['task'].url_for().with_query(fields='password'), headers=headers)
+    assert resp.status == 400
+
+
+async def test_search(client, token, user):
+    # Поиск по названию и описанию, вместе с фильтром status и постранично по rank.
+    for name, description, status in [('Купить молоко', 'в магазине', 'new'),
+                                      ('Магазин', 'молоко и хлеб', 'planned'),
+                                      ('Починить велосипед', 'колесо', 'new')]:
+        await client.app.objects.create(Task, user=user, name=name, description=description, status=status)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    resp = await client.get(client.app.router['task'].url_for().with_query(q='молоко', status='new'),
+                            headers=headers)
+    assert [task['name'] for task in (await resp.json())['results']] == ['Купить молоко']
+
+    url = client.app.router['task_search'].url_for()
+    resp = await client.get(url.with_query(q='молоко', limit=1), headers=headers)
+    page = await resp.json()
+    assert len(page['results']) == 1
+    resp = await client.get(url.with_query(q='молоко', limit=1, after=page['next_cursor']), headers=headers)
+    second = await resp.json()
+    assert {page['results'][0]['name'], second['results'][0]['name']} == {'Купить молоко', 'Магазин'}
+    assert page['results'][0]['rank'] >= second['results'][0]['rank']
+    assert second['next_cursor'] is None
+
+    resp = await client.get(url, headers=headers)
+    assert resp.status == 400
+
+
+async def test_search_equal_rank_pages(client, token, user):
+    # Записи с одинаковым rank на границе страниц не повторяются и не теряются.
+    ids = {(await client.app.objects.create(Task, user=user, name='Молоко', description='купить')).id
+           for _ in range(5)}
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['task_search'].url_for()
+    found, query = [], {'q': 'молоко', 'limit': 2}
+    while True:
+        page = await (await client.get(url.with_query(query), headers=headers)).json()
+        found.extend(task['id'] for task in page['results'])
+        if page['next_cursor'] is None:
+            break
+        query['after'] = page['next_cursor']
+    assert len({task['rank'] for task in page['results']}) == 1
+    assert sorted(found) == sorted(ids)
+
+
+async def test_stats(client, token, user):
+    # Сводка считается по счетчикам, которые обновляются при каждом изменении задач.
+    headers = {"Authorization": f"Bearer {token}"}
+    yesterday = (date.today() - timedelta(days=1)).strftime('%d-%m-%Y')
+    tomorrow = (date.today() + timedelta(days=1)).strftime('%d-%m-%Y')
+    url = client.app.router['task'].url_for()
+    for status, completion_at in [('new', yesterday), ('planned', tomorrow), ('in_work', tomorrow), ('new', None)]:
+        data = {'name': 'Task', 'description': 'description', 'status': status}
+        if completion_at:
+            data['completion_at'] = completion_at
+        await client.post(url, data=data, headers=headers)
+    tasks = {task.status: task for task in await client.app.objects.execute(Task.select().where(Task.user == user))}
+    await client.put(client.app.router['single_task'].url_for(id=str(tasks['in_work'].id)),
+                     data={'status': STATUS_LIST[3][0]}, headers=headers)
+
+    resp = await client.get(client.app.router['task_stats'].url_for(), headers=headers)
+    stats = await resp.json()
+    assert stats['total'] == 4
+    assert stats['status'] == {'new': 2, 'planned': 1, 'in_work': 0, STATUS_LIST[3][0]: 1}
+    assert (stats['overdue'], stats['due_soon']) == (1, 1)
+    assert stats['activity'][str(date.today())] == 1
+
+    with database.allow_sync():
+        rebuild(user.id)
+    resp = await client.get(client.app.router['task_stats'].url_for(), headers=headers)
+    assert await resp.json() == stats
+
+
+async def test_stats_overdue_rollup(client, token, user):
+    # Прошедшие сроки сворачиваются в счетчик overdue, ключей due: в прошлом не остается.
+    headers = {"Authorization": f"Bearer {token}"}
+    yesterday = (date.today() - timedelta(days=1)).strftime('%d-%m-%Y')
+    tomorrow = (date.today() + timedelta(days=1)).strftime('%d-%m-%Y')
+    for completion_at in (yesterday, tomorrow):
+        await client.post(client.app.router['task'].url_for(), headers=headers, data={
+            'name': 'Task', 'description': 'description', 'status': 'new', 'completion_at': completion_at})
+
+    with database.allow_sync():
+        rollup(today=date.today() + timedelta(days=2))
+    keys = {counter.key: counter.value for counter in await client.app.objects.execute(
+        TaskCounter.select().where(TaskCounter.user == user.id))}
+    assert keys['overdue'] == 2
+    assert not [key for key in keys if key.startswith('due:')]
+    resp = await client.get(client.app.router['task_stats'].url_for(), headers=headers)
+    assert ((await resp.json())['overdue'], (await resp.json())['due_soon']) == (2, 0)
+
+
+async def test_pool_stats(client):
+    # Пул открывается при старте и отдает свою статистику.
+    resp = await client.get(client.app.router['pool_stats'].url_for())
+    assert resp.status == 200
+    stats = await resp.json()
+    assert stats['size'] >= stats['min_size']
+    assert 'waiters' in stats
+
+
+async def test_token_of_deleted_user(client, user, user_token):
+    # Токен удаленного пользователя больше не принимается.
+    await client.app.objects.delete(user)
+    resp = await client.get(client.app.router['task'].url_for(),
+                            headers={"Authorization": f"Bearer {user_token}"})
+    assert resp.status == 401
+
+
+async def test_identity_cache(client, user, user_token, max_queries):
+    # Повторный запрос с тем же токеном не ищет пользователя в БД, после
+    # удаления пользователя запись кэша сбрасывается по уведомлению из БД.
+    await asyncio.wait_for(client.app.task_events.ready.wait(), 5)
+    url = client.app.router['task'].url_for()
+    headers = {"Authorization": f"Bearer {user_token}"}
+    assert (await client.get(url, headers=headers)).status == 200
+    with max_queries(10) as queries:
+        assert (await client.get(url, headers=headers)).status == 200
+    assert [sql for sql in queries if '"login"' in sql] == []
+
+    async def forgotten():
+        while identity_cache.get(user.login) is not None:
+            await asyncio.sleep(0.01)
+
+    await client.app.objects.delete(user)
+    await asyncio.wait_for(forgotten(), 5)
+    assert (await client.get(url, headers=headers)).status == 401
+
+
+async def test_write_ignores_stale_cache(client, token, task):
+    # PUT и DELETE читают задачу из БД: кэш другого воркера может быть устаревшим.
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['single_task'].url_for(id=str(task.id))
+    assert (await (await client.get(url, headers=headers)).json())['status'] == 'new'
+    await client.app.objects.execute(Task.update(status='planned').where(Task.id == task.id))
+
+    resp = await client.put(url, data={'status': 'new'}, headers=headers)
+    assert resp.status == 200
+    assert (await client.app.objects.get(Task, id=task.id)).status == 'new'
+
+    await client.app.objects.execute(Task.delete().where(Task.id == task.id))
+    resp = await client.put(url, data={'status': 'planned'}, headers=headers)
+    assert resp.status == 400
+    assert (await resp.json())['error'] == 'task not found'
+
+
+async def test_task_json_body(client, token, task):
+    # Задачу можно создать и изменить JSON-телом, ошибки проверки отдаются списком с кодом 400.
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = await client.post(client.app.router['task'].url_for(), json={
+        'name': 'JSON task', 'description': 'Описание', 'status': 'new', 'completion_at': '01-03-2021',
+    }, headers=headers)
+    assert resp.status == 201
+    assert (await resp.json())['completion_at'].startswith('2021-03-01')
+
+    url = client.app.router['single_task'].url_for(id=str(task.id))
+    resp = await client.put(url, json={'status': 'planned'}, headers=headers)
+    assert resp.status == 200
+    assert (await resp.json())['status'] == 'planned'
+
+    resp = await client.put(url, json={'status': 'wrong', 'completion_at': '2021-03-01'}, headers=headers)
+    assert resp.status == 400
+    assert {error['loc'][0] for error in (await resp.json())['error']} == {'status', 'completion_at'}
+
+    resp = await client.put(url, data=b'[1, 2]', headers={**headers, 'Content-Type': 'application/json'})
+    assert resp.status == 400
+    resp = await client.put(url, json={'description': 'x' * 70000}, headers=headers)
+    assert resp.status == 413
+
+    # Форма без Content-Length (chunked) ограничена так же.
+    async def chunks():
+        yield urlencode({'description': 'x' * 70000}).encode()
+
+    resp = await client.put(url, data=chunks(),
+                            headers={**headers, 'Content-Type': 'application/x-www-form-urlencoded'})
+    assert resp.status == 413
+
+
+async def test_update_all_fields(client, token, task):
+    # Все изменившиеся поля обновляются разом, на каждое поле пишется запись в историю.
+    resp = await client.put(client.app.router['single_task'].url_for(id=str(task.id)), data={
+        'name': 'Modifed name',
+        'description': 'Update description',
+        'status': 'planned',
+        'completion_at': '12-02-2020',
+    }, headers={"Authorization": f"Bearer {token}"})
+    assert resp.status == 200
+    data = await resp.json()
+    assert data['name'] == 'Modifed name'
+    assert data['status'] == 'planned'
+    assert data['completion_at'].startswith('2020-02-12')
+
+    logs = await client.app.objects.execute(TaskLog.select().where(TaskLog.task == task.id))
+    assert len(logs) == 4
+
+
+async def test_get_token_legacy_password(client, token):
+    # Пароль в старом формате (md5) принимается и перехешируется при входе.
+    await client.app.objects.create(User, login='ivan', password=legacy_hash('123456'))
+    resp = await client.post(client.app.router['gen_token'].url_for(), data={'login': 'ivan', 'password': '123456'})
+    assert resp.status == 200
+    user = await client.app.objects.get(User, login='ivan')
+    assert not needs_rehash(user.password)
+    assert check_password('123456', user.password)
+
+
+async def test_bulk_tasks(client, token, user):
+    # Массовое создание, изменение статуса и удаление задач с результатом по каждому элементу.
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['task_bulk'].url_for()
+    resp = await client.post(url, json={'tasks': [
+        {'name': 'Bulk 1', 'description': 'description', 'status': 'new'},
+        {'name': 'Bulk 2', 'description': 'description', 'status': 'wrong'},
+        {'name': 'Bulk 3', 'description': 'description', 'status': 'new', 'completion_at': '01-01-2021'},
+    ]}, headers=headers)
+    assert resp.status == 201
+    results = (await resp.json())['results']
+    assert results[0]['status'] == 'created'
+    assert 'error' in results[1]
+    assert results[2]['status'] == 'created'
+    ids = [results[0]['id'], results[2]['id']]
+
+    resp = await client.put(url, json={'ids': ids + [0], 'status': 'in_work'}, headers=headers)
+    assert resp.status == 200
+    results = (await resp.json())['results']
+    assert [item.get('status') for item in results] == ['updated', 'updated', None]
+    logs = await client.app.objects.execute(TaskLog.select().where(TaskLog.task.in_(ids)))
+    assert len(logs) == 2
+
+    resp = await client.delete(url, json={'ids': ids}, headers=headers)
+    assert resp.status == 200
+    assert [item['status'] for item in (await resp.json())['results']] == ['deleted', 'deleted']
+    assert await client.app.objects.count(Task.select().where(Task.id.in_(ids))) == 0
+
+
+async def test_batch(client, token, task):
+    # Операции выполняются по очереди, с atomic ошибка откатывает все изменения.
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['batch'].url_for()
+    path = f'/task/{task.id}'
+    # Задача уже в кэше: GET после PUT в том же batch видит новое значение.
+    await client.get(path, headers=headers)
+    resp = await client.post(url, json={'operations': [
+        {'method': 'PUT', 'path': path, 'data': {'status': 'in_work'}},
+        {'method': 'GET', 'path': f'{path}?fields=status'},
+        {'method': 'GET', 'path': '/task/events'},
+    ]}, headers=headers)
+    assert resp.status == 200
+    results = (await resp.json())['results']
+    assert [item['status'] for item in results] == [200, 200, 400]
+    assert results[1]['body']['status'] == 'in_work'
+
+    resp = await client.post(url, json={'atomic': True, 'operations': [
+        {'method': 'PUT', 'path': path, 'data': {'status': 'new'}},
+        {'method': 'DELETE', 'path': '/task/0'},
+    ]}, headers=headers)
+    assert resp.status == 400
+    results = (await resp.json())['results']
+    assert [(item['status'], item['applied']) for item in results] == [(200, False), (400, False)]
+    resp = await client.get(client.app.router['single_task'].url_for(id=str(task.id)), headers=headers)
+    assert (await resp.json())['status'] == 'in_work'
+
+
+async def test_batch_operation_error(client, token, task, monkeypatch):
+    # Без atomic упавшая операция дает 500 только в своем результате и
+    # откатывается одна, остальные операции batch сохраняются.
+    headers = {"Authorization": f"Bearer {token}"}
+    path = f'/task/{task.id}'
+
+    async def broken(*args):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(client.app.task_cache, 'get', broken)
+    resp = await client.post(client.app.router['batch'].url_for(), json={'operations': [
+        {'method': 'PUT', 'path': path, 'data': {'status': 'in_work'}},
+        {'method': 'GET', 'path': path},
+        {'method': 'PUT', 'path': path, 'data': {'name': 'Новое имя'}},
+    ]}, headers=headers)
+    assert resp.status == 200
+    results = (await resp.json())['results']
+    assert [item['status'] for item in results] == [200, 500, 200]
+    assert results[1]['body'] == {'error': 'internal error'}
+    task = await client.app.objects.get(Task, id=task.id)
+    assert (task.status, task.name) == ('in_work', 'Новое имя')
+
+
+async def test_get_history_pages_and_stream(client, token, task):
+    # История отдается постранично по курсору since и целиком потоком NDJSON.
+    await client.app.objects.execute(TaskLog.insert_many(
+        [{'task': task.id, 'log': f'Запись {i}'} for i in range(3)]))
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['task_log'].url_for(id=str(task.id))
+
+    resp = await client.get(url.with_query(limit=2), headers=headers)
+    page = await resp.json()
+    assert [log['log'] for log in page['results']] == ['Запись 0', 'Запись 1']
+    resp = await client.get(url.with_query(limit=2, since=page['next_cursor']), headers=headers)
+    page = await resp.json()
+    assert [log['log'] for log in page['results']] == ['Запись 2']
+    assert page['next_cursor'] is None
+
+    resp = await client.get(url.with_query(format='ndjson'), headers=headers)
+    assert resp.headers['Content-Type'] == 'application/x-ndjson'
+    lines = (await resp.text()).splitlines()
+    assert len(lines) == 3
+
+
+async def test_get_history_from_date(client, token, task):
+    # С from_date отдаются только записи начиная с этой даты.
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    await client.app.objects.execute(TaskLog.insert_many([
+        {'task': task.id, 'log': 'Старая запись', 'created_at': today - timedelta(days=60)},
+        {'task': task.id, 'log': 'Новая запись', 'created_at': today},
+    ]))
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['task_log'].url_for(id=str(task.id))
+
+    resp = await client.get(url.with_query(from_date=f'{today:%d-%m-%Y}'), headers=headers)
+    assert [log['log'] for log in (await resp.json())['results']] == ['Новая запись']
+    resp = await client.get(url.with_query(from_date='2020-01-01'), headers=headers)
+    assert resp.status == 400
+
+
+async def test_log_buffer(client, token, task):
+    # С отложенной записью история сразу видна в ответе и попадает в БД при остановке.
+    client.app.log_buffer = LogBuffer(client.app.objects, interval=60)
+    client.app.log_buffer.start()
+    headers = {"Authorization": f"Bearer {token}"}
+    await client.put(client.app.router['single_task'].url_for(id=str(task.id)),
+                     data={'status': 'planned'}, headers=headers)
+    assert await client.app.objects.count(TaskLog.select().where(TaskLog.task == task.id)) == 0
+
+    resp = await client.get(client.app.router['task_log'].url_for(id=str(task.id)), headers=headers)
+    assert [log['log'] for log in (await resp.json())['results']] == ['Значение поля status изменено на planned']
+
+    await client.app.log_buffer.close()
+    client.app.log_buffer = None
+    assert await client.app.objects.count(TaskLog.select().where(TaskLog.task == task.id)) == 1
+
+
+async def test_log_buffer_overflow(client, task, max_queries):
+    # При заполненной очереди put ждет не дольше put_timeout на все записи,
+    # а не поместившиеся пишет одним insert_many.
+    buffer = LogBuffer(client.app.objects, maxsize=1, interval=60, put_timeout=0.1)
+    logs = [{'task': task.id, 'log': f'Запись {i}'} for i in range(3)]
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    with max_queries(1):
+        await buffer.put(logs)
+    assert loop.time() - start < 0.2
+    assert buffer.overflows == 2
+    assert await client.app.objects.count(TaskLog.select().where(TaskLog.task == task.id)) == 2
+
+    buffer.start()
+    await buffer.close()
+    assert await client.app.objects.count(TaskLog.select().where(TaskLog.task == task.id)) == 3
+
+
+async def test_log_buffer_drops_bad_rows(client, token, task):
+    # Запись, которую БД не принимает, отбрасывается, остальные пишутся,
+    # и остановка буфера не зависает на повторах.
+    buffer = LogBuffer(client.app.objects, interval=60)
+    buffer.start()
+    await buffer.put([{'task': task.id, 'log': 'x' * 300}, {'task': task.id, 'log': 'Запись'}])
+    await asyncio.wait_for(buffer.close(), 5)
+    logs = await client.app.objects.execute(TaskLog.select().where(TaskLog.task == task.id))
+    assert [log.log for log in logs] == ['Запись']
+
+    # Длинное значение поля в истории обрезается по длине колонки.
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = await client.put(client.app.router['single_task'].url_for(id=str(task.id)),
+                            data={'description': 'd' * 500}, headers=headers)
+    assert resp.status == 200
+    logs = await client.app.objects.execute(TaskLog.select().where(TaskLog.task == task.id, TaskLog.log != 'Запись'))
+    assert [len(log.log) for log in logs] == [TaskLog.log.max_length]
+
+
+async def test_task_events(client, token, task):
+    # Изменение задачи приходит подписчику ленты событий.
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = await client.get(client.app.router['task_events'].url_for(), headers=headers)
+    assert resp.headers['Content-Type'] == 'text/event-stream'
+    while await resp.content.readline() != b'event: ready\n':
+        pass
+
+    await client.put(client.app.router['single_task'].url_for(id=str(task.id)),
+                     data={'status': 'planned'}, headers=headers)
+    lines = []
+    while b'event: updated\n' not in lines:
+        lines.append(await resp.content.readline())
+        assert lines[-1]
+    data = json.loads((await resp.content.readline())[len(b'data: '):])
+    assert data == {'event': 'updated', 'ids': [task.id]}
+    resp.close()
+
+
+def test_notify_caps_ids():
+    # Большие пачки приходят без списка id, только с их числом.
+    payload = notify(1, 'deleted', range(3), max_ids=2).arguments[1]
+    assert json.loads(payload) == {'user': 1, 'event': 'deleted', 'ids': None, 'count': 3}
+    payload = notify(1, 'deleted', range(2), max_ids=2).arguments[1]
+    assert json.loads(payload) == {'user': 1, 'event': 'deleted', 'ids': [0, 1]}
+
+
+def test_expired_partitions():
+    # Удаляются только секции старше заданного числа полных месяцев, default не трогаем.
+    names = ['tasklog_default', 'tasklog_p2019_12', 'tasklog_p2020_01', 'tasklog_p2020_02']
+    assert expired_partitions(names, 1, today=date(2020, 3, 15)) == ['tasklog_p2019_12', 'tasklog_p2020_01']
+    assert expired_partitions(names, 12, today=date(2020, 3, 15)) == []
+
+
+async def test_create_partition_moves_default_rows(task):
+    # Записи месяца без секции лежат в tasklog_default: при создании секции
+    # они переносятся в нее, default остается присоединенной.
+    db = peewee.PostgresqlDatabase(**DATABASE)
+    if not is_partitioned(db):
+        pytest.skip('tasklog не секционирована')
+    month = date(2099, 1, 1)
+    name = partition_name(month)
+    db.execute_sql(f'INSERT INTO "{DEFAULT}" (task_id, log, created_at) VALUES (%s, %s, %s)',
+                   (task.id, 'stray', datetime(2099, 1, 15)))
+    try:
+        assert create_partition(month, db) == 1
+        assert {name, DEFAULT} <= set(partitions(db))
+        assert db.execute_sql(f'SELECT log FROM "{name}"').fetchall() == [('stray',)]
+        assert db.execute_sql(f'SELECT count(*) FROM "{DEFAULT}" WHERE task_id = %s',
+                              (task.id,)).fetchone()[0] == 0
+    finally:
+        db.execute_sql(f'DROP TABLE IF EXISTS "{name}"')
+        db.close()
+
+
+async def test_prepared_statements(client, token, task):
+    # Список задач идет через шаблон: константы в тексте, значения только параметрами,
+    # на соединении пула запрос подготавливается один раз.
+    statement = task_page(('name',), True, False, True, False)
+    assert statement.params == ['user', 'status', 'q', 'limit']
+    assert "|| ' ')" in statement.sql and '%s' not in statement.sql
+
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['task'].url_for().with_query({'status': 'new', 'fields': 'name'})
+    first = await (await client.get(url, headers=headers)).json()
+    second = await (await client.get(url, headers=headers)).json()
+    assert first['results'] == second['results'] == [{'name': task.name}]
+    assert client.app.database.pool_stats()['prepared_statements'] >= 2
+
+
+async def test_prepared_duplicate_in_transaction(client, task):
+    # Повторный PREPARE на соединении (ответ на первый потерялся) внутри
+    # транзакции не должен ее прерывать.
+    objects = client.app.objects
+    async with objects.atomic():
+        assert (await objects.prepared(TASK_BY_ID, id=task.id))[0]['id'] == task.id
+        for names in client.app.database._async_conn.prepared.values():
+            names.clear()
+        assert (await objects.prepared(TASK_BY_ID, id=task.id))[0]['id'] == task.id
+        assert await objects.count(Task.select().where(Task.id == task.id)) == 1
+
+
+async def test_metrics(client, token, user):
+    # Метрики содержат запросы по маршрутам и число запросов к БД.
+    await client.get(client.app.router['task'].url_for(), headers={"Authorization": f"Bearer {token}"})
+    resp = await client.get(client.app.router['metrics'].url_for())
+    assert resp.status == 200
+    text = await resp.text()
+    assert 'http_requests_total{route="/task",method="GET",status="200"} 1' in text
+    assert 'db_queries_per_request_count{route="/task",method="GET"} 1' in text
+    assert 'db_pool_in_use' in text
+
+
+async def test_task_cache(client, task, redis_stub, max_queries):
+    # Задача читается из БД один раз, после invalidate снова из БД.
+    for cache in (client.app.task_cache, TaskCache(RedisBackend(redis_stub))):
+        with max_queries(1):
+            assert (await cache.get(client.app.objects, task.id))['name'] == task.name
+            cached = await cache.get(client.app.objects, task.id)
+        assert cached['created_at'] == task.created_at
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        await client.app.objects.execute(Task.update(name='Renamed').where(Task.id == task.id))
+        await cache.invalidate(task.id)
+        assert (await cache.get(client.app.objects, task.id))['name'] == 'Renamed'
+        await cache.close()
+
+
+async def test_task_cache_fill_race(client, token, task, monkeypatch):
+    # GET прочитал задачу из БД, PUT изменил и сбросил ее до того, как GET
+    # положил старую версию в кэш: старая версия в кэш не попадает.
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['single_task'].url_for(id=str(task.id))
+    prepared = client.app.objects.prepared
+    loaded, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_prepared(statement, **values):
+        rows = await prepared(statement, **values)
+        if statement is TASK_BY_ID and not release.is_set():
+            loaded.set()
+            await release.wait()
+        return rows
+
+    monkeypatch.setattr(client.app.objects, 'prepared', slow_prepared)
+    get = asyncio.ensure_future(client.get(url, headers=headers))
+    await loaded.wait()
+    resp = await client.put(url, data={'status': 'planned'}, headers=headers)
+    assert resp.status == 200
+    release.set()
+    old = await get
+    assert (await old.json())['status'] == 'new'
+
+    # Старый ETag больше не совпадает, опрашивающий клиент получает новые данные.
+    resp = await client.get(url, headers={**headers, 'If-None-Match': old.headers['ETag']})
+    assert resp.status == 200
+    assert (await resp.json())['status'] == 'planned'
+
+
+async def test_query_counts(client, token, task, max_queries):
+    # Число запросов к БД на каждый маршрут не зависит от объема данных.
+    headers = {"Authorization": f"Bearer {token}"}
+    with max_queries(3):
+        await client.get(client.app.router['task'].url_for(), headers=headers)
+    with max_queries(3):
+        await client.post(client.app.router['task'].url_for(), data={
+            'name': 'New task', 'description': 'Описание', 'status': 'new'}, headers=headers)
+    with max_queries(1):
+        await client.get(client.app.router['single_task'].url_for(id=str(task.id)), headers=headers)
+    with max_queries(5):
+        await client.put(client.app.router['single_task'].url_for(id=str(task.id)), data={
+            'name': 'Modifed name', 'description': 'Update description',
+            'status': 'planned', 'completion_at': '12-02-2020'}, headers=headers)
+    with max_queries(1):
+        await client.get(client.app.router['task_log'].url_for(id=str(task.id)), headers=headers)
+    with max_queries(4):
+        await client.delete(client.app.router['single_task'].url_for(id=str(task.id)), headers=headers)
+
+
+async def test_conditional_get_queries(client, token, task, max_queries):
+    # Совпавший If-None-Match обходится одним маленьким запросом.
+    headers = {"Authorization": f"Bearer {token}"}
+    url = client.app.router['single_task'].url_for(id=str(task.id))
+    etag = (await client.get(url, headers=headers)).headers['ETag']
+    with max_queries(1):
+        resp = await client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert resp.status == 304